@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
-from flask import Flask, send_file, render_template, redirect, url_for, request, jsonify
+from flask import Flask, Response, send_file, render_template, redirect, url_for, request, jsonify
 from pathlib import Path
-from ebooklib import epub
-from bs4 import BeautifulSoup
 import humanize  # pip install humanize
+import generate
+import formats
+import metrics
+import edition_index
+from build_queue import BuildQueue
+from email_service import DeliveryQueue
+import json
 import threading
 import time
-import subprocess
-import sys
 from datetime import datetime, timedelta
 
 # -----------------------------
@@ -15,39 +18,30 @@ from datetime import datetime, timedelta
 # -----------------------------
 app = Flask(__name__)
 OUTPUT = Path("output")
-GENERATION_STATE = {"status": "idle", "message": ""}
+# Latest edition's sidecar index, reloaded only when output/ changes or a build completes
+EDITIONS = edition_index.EditionCache(OUTPUT)
+# Every build (form, scheduler, /jobs API) runs through this queue, in this long-lived process:
+# imports, HTTP connections and caches stay warm between builds. Set up by start().
+BUILDS = None
+# Send to Kindle runs in the background over a reused SMTP connection. Set up by start().
+DELIVERIES = None
+# Progress streams: idle keepalive interval (seconds) and the browser's reconnect delay
+SSE_KEEPALIVE = 15
+SSE_RETRY_MS = 3000
 
 # -----------------------------
 # Scheduler & Generation Logic
 # -----------------------------
-def run_generation_process(article_count, sections_arg):
-    global GENERATION_STATE
-    GENERATION_STATE = {"status": "running", "message": "Starting generation..."}
-    
-    try:
-        # Run the script
-        subprocess.check_call([sys.executable, "generate.py", article_count, sections_arg])
-        GENERATION_STATE = {"status": "complete", "message": "Generation successful!"}
-    except subprocess.CalledProcessError as e:
-        GENERATION_STATE = {"status": "error", "message": f"Error: {e}"}
-    except Exception as e:
-        GENERATION_STATE = {"status": "error", "message": f"Unexpected error: {e}"}
-    
-    # Wait a bit then reset
-    time.sleep(5)
-    if GENERATION_STATE["status"] == "complete":
-        GENERATION_STATE = {"status": "idle", "message": ""}
+def request_build(article_count, sections_arg, source="web", skip_if_locked=False):
+    config = generate.parse_args([article_count, sections_arg])
+    return BUILDS.submit(config, source=source, skip_if_locked=skip_if_locked)
 
 def run_generation_task():
-    # Helper for the scheduled task
-    global GENERATION_STATE
-    if GENERATION_STATE["status"] == "running":
-        print("Skipping scheduled run: Generation already in progress.")
-        return
-
+    # Helper for the scheduled task. The container's cron may be running the same build:
+    # the shared build lock makes this one skip instead of building twice
     print(f"[{datetime.now()}] Starting scheduled generation...")
     # Default: 5 articles, all sections
-    run_generation_process("5", "")
+    request_build("5", "", source="scheduler", skip_if_locked=True)
 
 def scheduler_loop():
     while True:
@@ -68,22 +62,56 @@ def start_scheduler():
     thread = threading.Thread(target=scheduler_loop, daemon=True)
     thread.start()
 
-# Start scheduler on launch
-start_scheduler()
+def start():
+    """
+    Starts the build and delivery queues and the scheduler. Called from the server process
+    only: process pool workers import this script again (as __mp_main__), and must not get
+    queues or a scheduler of their own.
+    """
+    global BUILDS, DELIVERIES
+    BUILDS = BuildQueue(on_complete=lambda job: EDITIONS.invalidate())
+    DELIVERIES = DeliveryQueue()
+    start_scheduler()
 
 # -----------------------------
 # Helpers
 # -----------------------------
 def get_latest_file(extension: str) -> Path:
-    files = list(OUTPUT.glob(f"*.{extension}"))
-    if not files:
+    edition = EDITIONS.get()
+    if edition is None or extension not in edition["files"]:
+        return None
+    return edition["files"][extension]["path"]
+
+def converted(edition, fmt):
+    """
+    The edition with fmt available: formats that weren't pre-built are converted on first
+    request, then served from disk. Returns None if the conversion fails.
+    """
+    if fmt in edition["files"]:
+        return edition
+    try:
+        formats.ensure(edition["files"]["epub"]["path"], fmt)
+    except Exception as e:
+        print(f"⚠ {fmt.upper()} conversion failed: {e}")
         return None
-    files.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-    return files[0]
+    EDITIONS.invalidate()
+    return EDITIONS.get(edition["date"])
 
-def human_readable_size(file_path: Path) -> str:
-    if file_path and file_path.exists():
-        return humanize.naturalsize(file_path.stat().st_size)
+def send_edition(edition, fmt):
+    """
+    Serves one format of an edition with a strong content-hash ETag: conditional requests get
+    304 and Range requests (resumed downloads) 206, both handled by send_file.
+    """
+    info = edition["files"][fmt]
+    response = send_file(info["path"], as_attachment=True, conditional=True, etag=info["etag"],
+                         last_modified=info["modified"])
+    # A same-day rebuild replaces the file: clients may keep it, but must revalidate
+    response.cache_control.no_cache = True
+    return response
+
+def human_readable_size(edition, extension: str) -> str:
+    if edition and extension in edition["files"]:
+        return humanize.naturalsize(edition["files"][extension]["bytes"])
     return "0 B"
 
 # -----------------------------
@@ -91,77 +119,147 @@ def human_readable_size(file_path: Path) -> str:
 # -----------------------------
 @app.route("/", methods=["GET"])
 def index():
-    titles = []
-    epub_file = get_latest_file("epub")
-    mobi_file = get_latest_file("mobi")
-
-    if epub_file and epub_file.exists():
-        try:
-            book = epub.read_epub(str(epub_file))
-            for item in book.items:
-                if isinstance(item, epub.EpubHtml):
-                    title = item.title
-                    if not title:
-                        soup = BeautifulSoup(item.content, "html.parser")
-                        h1 = soup.find("h1")
-                        title = h1.get_text() if h1 else item.file_name
-                    if title and title not in ["Table of Contents", "Cover", "Contents"]:
-                        titles.append(title)
-        except Exception as e:
-            print(f"Error reading epub: {e}")
+    # Titles and sizes come from the build's sidecar index, cached in memory
+    edition = EDITIONS.get()
+    has_epub = edition is not None and "epub" in edition["files"]
+    # The page follows the job it just submitted, else whatever build is running
+    job_id = request.args.get("job")
+    if job_id is None and BUILDS.current() is not None:
+        job_id = BUILDS.current().id
+    delivery = DELIVERIES.get(request.args.get("delivery", ""))
 
     return render_template(
         "index.html",
-        titles=titles,
-        epub_exists=epub_file is not None,
-        mobi_exists=mobi_file is not None,
-        epub_size=human_readable_size(epub_file),
-        mobi_size=human_readable_size(mobi_file)
+        job_id=job_id or "",
+        delivery=delivery.to_dict() if delivery else None,
+        titles=edition["titles"] if edition else [],
+        epub_exists=has_epub,
+        # MOBI is always offered: it is converted on first download when not pre-built
+        mobi_exists=has_epub,
+        epub_size=human_readable_size(edition, "epub"),
+        mobi_size=human_readable_size(edition, "mobi") if edition and "mobi" in edition["files"] else "built on download",
+        past_editions=[{"date": e["date"], "size": human_readable_size(e, "epub")} for e in EDITIONS.editions()[1:]],
     )
 
 @app.route("/status", methods=["GET"])
 def get_status():
-    return jsonify(GENERATION_STATE)
+    # Kept for older clients: the state of the current (or most recent) job
+    job = BUILDS.current() or next(iter(BUILDS.jobs()), None)
+    if job is None:
+        return jsonify({"status": "idle", "message": ""})
+    status = "running" if job.active else job.status
+    return jsonify({"status": status, "message": job.message, "job": job.id, "progress": job.progress})
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify([job.to_dict() for job in BUILDS.jobs()])
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    data = request.get_json(silent=True) or request.form
+    sections = data.get("sections") or ""
+    if isinstance(sections, list):
+        sections = ",".join(sections)
+    job = request_build(str(data.get("article_count", "5")), sections, source="api")
+    return jsonify(job.to_dict()), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = BUILDS.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    # Server-sent events: one "progress" event per job update (section and article as they are
+    # processed), ending after the job finishes. Reconnecting clients resume from Last-Event-ID.
+    job = BUILDS.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    try:
+        after = int(request.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        after = 0
+
+    def stream(after):
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            # A finished job gets no more events: send what the client hasn't seen, then done
+            finished = not job.active
+            events = job.wait_events(after, timeout=0 if finished else SSE_KEEPALIVE)
+            for event in events:
+                after = event["seq"]
+                yield f"id: {after}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            if finished or (events and events[-1]["status"] not in ("queued", "running")):
+                yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+            if not events:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+
+    return Response(stream(after), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.prometheus_text(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/generate", methods=["POST"])
 def gen():
-    global GENERATION_STATE
-    if GENERATION_STATE["status"] == "running":
-        return redirect(url_for("index"))
-
     article_count = request.form.get("article_count", "5")
     selected_sections = request.form.getlist("sections")
     sections_arg = ",".join(selected_sections) if selected_sections else ""
 
-    thread = threading.Thread(target=run_generation_process, args=(article_count, sections_arg))
-    thread.start()
-    
-    return redirect(url_for("index"))
+    # Identical requests (double clicks, two tabs) share one job
+    job = request_build(article_count, sections_arg)
+    return redirect(url_for("index", job=job.id))
 
 @app.route("/download/<fmt>", methods=["GET"])
 def download(fmt):
-    target_file = get_latest_file(fmt)
-    if target_file and target_file.exists():
-        return send_file(str(target_file), as_attachment=True)
-    return redirect(url_for("index"))
+    edition = EDITIONS.get()
+    if fmt not in formats.FORMATS or edition is None or "epub" not in edition["files"]:
+        return redirect(url_for("index"))
+    edition = converted(edition, fmt)
+    if edition is None:
+        return redirect(url_for("index"))
+    return send_edition(edition, fmt)
+
+@app.route("/editions/<date>/<fmt>", methods=["GET"])
+def download_edition(date, fmt):
+    # Stable URL for one day's edition (the latest is also at /download/<fmt>)
+    edition = EDITIONS.get(date)
+    if fmt not in formats.FORMATS or edition is None or "epub" not in edition["files"]:
+        return jsonify({"error": "no such edition"}), 404
+    edition = converted(edition, fmt)
+    if edition is None:
+        return jsonify({"error": f"{fmt} conversion failed"}), 500
+    return send_edition(edition, fmt)
 
 @app.route("/send-kindle", methods=["POST"])
 def send_kindle_route():
-    from email_service import send_to_kindle
     custom_email = request.form.get("custom_email")
     if custom_email and not custom_email.strip():
         custom_email = None
         
     epub_file = get_latest_file("epub")
     if epub_file:
-        success = send_to_kindle(epub_file, override_email=custom_email)
-        if success:
-            print(f"Sent EPUB to Kindle ({custom_email if custom_email else 'default'}) via web request.")
+        # Queued: the page returns straight away and follows the delivery
+        delivery = DELIVERIES.submit(epub_file, override_email=custom_email)
+        return redirect(url_for("index", delivery=delivery.id))
     return redirect(url_for("index"))
 
+@app.route("/deliveries/<delivery_id>", methods=["GET"])
+def get_delivery(delivery_id):
+    delivery = DELIVERIES.get(delivery_id)
+    if delivery is None:
+        return jsonify({"error": "unknown delivery"}), 404
+    return jsonify(delivery.to_dict())
+
 # -----------------------------
 # Main
 # -----------------------------
 if __name__ == "__main__":
     OUTPUT.mkdir(exist_ok=True)
+    start()
     app.run(host="0.0.0.0", port=5000)
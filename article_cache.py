@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import metrics
+from cache_paths import CACHE_DIR, sqlite_connector
+
+# Cleaned article HTML (plus any page metadata the extractor found) keyed by canonical URL,
+# shared by all fetchers. Feed articles also record the feed entry's revision, so a story the
+# feed reports as updated is fetched again instead of served from the cache.
+# ARTICLE_CACHE_TTL_HOURS bounds staleness, ARTICLE_CACHE_MB bounds disk use (LRU eviction).
+DB_PATH = CACHE_DIR / "articles.sqlite"
+TTL_SECONDS = float(os.getenv("ARTICLE_CACHE_TTL_HOURS", "72")) * 3600
+MAX_BYTES = int(float(os.getenv("ARTICLE_CACHE_MB", "200")) * 1024 * 1024)
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {"CMP", "cmp", "at_medium", "at_campaign", "at_custom1", "fbclid", "gclid", "ocid"}
+
+STATS = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def canonical_url(url):
+    """
+    Normalises an article url so tracking parameters and fragments don't split the cache.
+    Other query parameters are kept (e.g. news.ycombinator.com/item?id=...).
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/") or "/"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in TRACKING_PARAMS and not k.startswith("utm_"))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+
+def _init(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS articles ("
+        " url TEXT PRIMARY KEY, html TEXT NOT NULL, size INTEGER NOT NULL,"
+        " fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, meta TEXT, revision TEXT)"
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(articles)")}
+    # Caches from before page metadata and revisions were kept
+    for column in ("meta", "revision"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE articles ADD COLUMN {column} TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed_at)")
+
+
+_connect = sqlite_connector(DB_PATH, _init)
+
+
+def get(url, max_age=None):
+    """
+    Returns the cached cleaned HTML for url, or None if missing or older than max_age seconds.
+    """
+    found = lookup(url, max_age)
+    return found[0] if found is not None else None
+
+
+def lookup(url, max_age=None, revision=None):
+    """
+    Like get(), but returns (html, meta dict) for a cached article. With revision, an entry
+    stored for a different revision (see put) counts as missing.
+    """
+    key = canonical_url(url)
+    max_age = TTL_SECONDS if max_age is None else max_age
+    now = time.time()
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                row = conn.execute("SELECT html, fetched_at, meta, revision FROM articles WHERE url = ?",
+                                   (key,)).fetchone()
+                if row and now - row[1] <= max_age and (revision is None or row[3] == revision):
+                    conn.execute("UPDATE articles SET accessed_at = ? WHERE url = ?", (now, key))
+                    conn.commit()
+                    if metrics.live():
+                        STATS["hits"] += 1
+                    return row[0], json.loads(row[2]) if row[2] else {}
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"   article cache read failed: {e}")
+        if metrics.live():
+            STATS["misses"] += 1
+    return None
+
+
+def put(url, html, meta=None, revision=None):
+    """
+    Stores the cleaned HTML for url. revision identifies the version of the article it came
+    from (e.g. edition_manifest.entry_fingerprint of its feed entry).
+    """
+    key = canonical_url(url)
+    now = time.time()
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO articles (url, html, size, fetched_at, accessed_at, meta, revision)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, html, len(html.encode("utf-8")), now, now, json.dumps(meta) if meta else None, revision),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"   article cache write failed: {e}")
+
+
+def evict():
+    """
+    Drops expired entries, then least-recently-used ones until the cache fits MAX_BYTES.
+    """
+    now = time.time()
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                conn.execute("DELETE FROM articles WHERE fetched_at < ?", (now - TTL_SECONDS,))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM articles").fetchone()[0]
+                if total > MAX_BYTES:
+                    doomed = []
+                    for url, size in conn.execute("SELECT url, size FROM articles ORDER BY accessed_at"):
+                        if total <= MAX_BYTES:
+                            break
+                        doomed.append((url,))
+                        total -= size
+                    conn.executemany("DELETE FROM articles WHERE url = ?", doomed)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠ Article cache eviction failed: {e}")
+
+
+def summary():
+    return f"Article cache: {STATS['hits']} hits, {STATS['misses']} misses"
@@ -1,120 +1,138 @@
-import feedparser
-import requests
-from readability import Document
-from bs4 import BeautifulSoup
-from ebooklib import epub
-from PIL import Image
-import io
-from datetime import datetime
+import os
+
+import deadline
+import metrics
+from feed_cache import parse_cached
+from fetch_pool import map_ordered
+from images import add_to_book
+import extract
+from extract import chapter_html, pub_date
+from edition_manifest import entry_fingerprint
+from deadline import DeadlineExceeded
 
 BBC_FEED_URL = "http://feeds.bbci.co.uk/news/rss.xml"
-HEADERS = {"User-Agent": "Mozilla/5.0"}
+# Seconds the BBC stories may take within the build's budget (0 = no separate limit)
+BUDGET = float(os.getenv("BBC_BUDGET", "120"))
 
-def fetch_bbc_news(limit, book):
+def fetch_bbc_news(limit, book, entries=None, previous=None, manifest=None, progress=None):
     """
-    Fetches top stories from BBC News, cleans them, and returns a list of EpubHtml objects.
+    Fetches top stories from BBC News, cleans them, writes them into the book and returns
+    their epub_writer.Chapter records.
+    Pass entries when the feed was already resolved by the feed discovery phase, and previous
+    (an edition_manifest.PreviousEdition) to copy unchanged stories from the last edition.
+    progress, if given, is called as progress(done, limit, title) after each story.
+    Stops at BUDGET (or the build's deadline) with the stories finished so far.
     """
     print(f"\n== BBC Top Stories")
-    feed = feedparser.parse(BBC_FEED_URL)
+    if entries is None:
+        entries = parse_cached(BBC_FEED_URL)
     
-    if not feed.entries:
+    if not entries:
         print(" ⚠ No entries found")
         return []
 
+    # 1. Filter out non-article content
+    # BBC Live blogs often contain '/live/'
+    # BBC Video pages often contain '/av/'
+    candidates = [e for e in entries if "/live/" not in e.link and "/av/" not in e.link]
+
+    with deadline.limit("BBC", BUDGET):
+        return _fetch_stories(candidates, limit, book, previous, manifest, progress)
+
+
+def _fetch_stories(candidates, limit, book, previous, manifest, progress):
     chapters = []
     count = 0
-
-    for idx, entry in enumerate(feed.entries):
-        if count >= limit:
-            break
-
-        # 1. Filter out non-article content
-        # BBC Live blogs often contain '/live/'
-        # BBC Video pages often contain '/av/'
-        if "/live/" in entry.link or "/av/" in entry.link:
-            continue
-
-        print(" •", entry.title)
-        
-        try:
-            # 2. Fetch content
-            r = requests.get(entry.link, headers=HEADERS, timeout=15)
-            r.raise_for_status()
-
-            # 3. Parse with Readability
-            doc = Document(r.text)
-            soup = BeautifulSoup(doc.summary(), "html.parser")
-
-            # 4. BBC Specific Cleanup
-            # Remove "Related Topics" or "More on this story" often found in footer divs
-            for div in soup.find_all("div", attrs={"data-component": "text-block"}):
-                 if div.get_text().strip() == "Related Topics":
-                     div.decompose()
-
-            # Remove video placeholders if they remain
-            for fig in soup.find_all("figure", class_="media-player"):
-                fig.decompose()
-
-            # 5. Image Handling
-            # Try to find a high-res image from the metadata or the entry
-            img_url = None
-            if hasattr(entry, "media_thumbnail"):
-                # BBC RSS often has media_thumbnail
-                thumbnails = entry.media_thumbnail
-                if thumbnails:
-                    # Pick the largest if multiple (usually the last one is biggest)
-                    img_url = thumbnails[-1]['url']
-            
-            if img_url:
-                try:
-                    # Basic image download and processing
-                    img_res = requests.get(img_url, headers=HEADERS, timeout=10)
-                    im = Image.open(io.BytesIO(img_res.content))
-                    im = im.convert("RGB")
-                    buf = io.BytesIO()
-                    im.save(buf, "JPEG", quality=60)
-                    img_data = buf.getvalue()
-
-                    # Unique ID for the image
-                    img_name = f"bbc-{count}.jpg"
-                    img_item = epub.EpubItem(
-                        uid=img_name,
-                        file_name=f"images/{img_name}",
-                        media_type="image/jpeg",
-                        content=img_data
-                    )
-                    book.add_item(img_item)
-
-                    # Insert into soup
-                    img_tag = soup.new_tag("img", src=f"images/{img_name}")
-                    soup.insert(0, img_tag)
-                except Exception as e:
-                    print(f"   image failed: {e}")
-
-            # 6. Build Content
-            h1 = soup.new_tag("h1")
-            h1.string = entry.title
-            soup.insert(0, h1)
-
-            # Add Date
-            if hasattr(entry, "published_parsed"):
-                d = datetime(*entry.published_parsed[:6])
-                p_date = soup.new_tag("p")
-                p_date.string = d.strftime("%d %b %Y %H:%M")
-                soup.insert(1, p_date)
-
-            # Create Chapter
-            fname = f"bbc-{count}.xhtml"
-            chap = epub.EpubHtml(
-                title=entry.title,
-                file_name=fname,
-                content=str(soup)
-            )
-            book.add_item(chap)
-            chapters.append(chap)
-            count += 1
-
-        except Exception as e:
-            print(f"   article error: {e}")
+    late = []
+
+    # 2. Fetch and clean content in parallel waves: each wave requests just enough candidates to
+    # fill the remaining slots, so a failed article is replaced by the next one in the feed.
+    while count < limit and candidates and not deadline.expired():
+        wave, candidates = candidates[:limit - count], candidates[limit - count:]
+        reused = [previous.reuse(entry) if previous is not None else None for entry in wave]
+        # Stories that are new, changed or unreadable in the old archive are downloaded
+        pending = [entry for entry, chapter in zip(wave, reused) if chapter is None]
+        downloads = iter(map_ordered(download_article, pending))
+        for entry, chapter in zip(wave, reused):
+            if count >= limit:
+                break
+            if chapter is not None:
+                chap, digests = reuse_chapter(entry, chapter, count, book)
+            else:
+                result, error = next(downloads)
+                if isinstance(error, DeadlineExceeded):
+                    late.append(entry)
+                chap, digests = build_chapter(entry, result, error, count, book)
+            if chap:
+                if manifest is not None:
+                    manifest.add("BBC Top Stories", chap, entry.link, entry_fingerprint(entry), digests)
+                chapters.append(chap)
+                count += 1
+                if progress is not None:
+                    progress(count, limit, entry.title)
+
+    if count < limit and deadline.expired():
+        # The stories that would have filled the remaining slots
+        print(f"   ⚠ {deadline.reason()}: {limit - count} stories short")
+        for entry in (late + candidates)[:limit - count]:
+            metrics.dropped("bbc", entry.title, deadline.reason())
 
     return chapters
+
+
+def pick_image_url(entry):
+    # BBC RSS usually carries thumbnails; the last one is the largest
+    thumbnails = getattr(entry, "media_thumbnail", None)
+    return thumbnails[-1]["url"] if thumbnails else None
+
+
+def download_article(entry):
+    # Fast path or readability, plus the BBC-specific cleanup rules (related topics, video placeholders)
+    return extract.download_article("bbc", entry, pick_image_url)
+
+
+def reuse_chapter(entry, chapter, count, book):
+    """
+    Adds a chapter copied from the previous edition (plus its images) to the book.
+    Returns (chapter, image digests).
+    """
+    print(" •", entry.title, "(unchanged)")
+    content, chapter_images = chapter
+    for digest, data in chapter_images:
+        add_to_book(book, digest, data)
+    chap = book.add_document(entry.title, f"bbc-{count}.xhtml", content)
+    return chap, [digest for digest, _ in chapter_images]
+
+
+def build_chapter(entry, result, error, count, book):
+    """
+    Turns a downloaded BBC article into a chapter and adds it (plus its image) to the book.
+    Returns (chapter, image digests), or (None, []) when the article failed.
+    """
+    print(" •", entry.title)
+
+    try:
+        if error:
+            raise error
+        body, image, img_error, meta = result
+
+        # 3. Image Handling
+        if img_error:
+            print(f"   image failed: {img_error}")
+
+        # Shared images are only stored in the book once
+        img_src = add_to_book(book, *image) if image else None
+
+        # 4. Create Chapter
+        fname = f"bbc-{count}.xhtml"
+        chap = book.add_chapter(entry.title, fname, chapter_html(entry.title, pub_date(entry, meta), img_src, body))
+        return chap, [image[0]] if image else []
+
+    except Exception as e:
+        print(f"   article error: {e}")
+        if not isinstance(e, DeadlineExceeded):
+            # Late stories are reported with the slots they leave empty
+            metrics.dropped("bbc", entry.title, str(e))
+
+    return None, []
+
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Benchmarks full edition builds offline, against a local stand-in for every site.
+
+    python benchmarks/bench_build.py [--articles 1,5,20] [--sections "UK News, World"]
+                                     [--latency 0.05] [--bandwidth 2000000]
+                                     [--fixtures DIR] [--warm] [--json results.json]
+    python benchmarks/bench_build.py record DIR [--articles 5]
+
+Each scenario builds in a fresh child process with its own cache and output directories
+and reports wall-clock, CPU time (user+sys, including the process pool), peak RSS, EPUB
+size and the number of requests served. --warm builds every scenario a second time on the
+same caches. Without --fixtures the synthetic site from local_site.py is served; `record`
+saves a live build's responses to DIR for later use with --fixtures DIR.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(BENCH_DIR))
+
+from local_site import LocalSite, RecordedSite, SyntheticSite, save_fixture, use_local_site
+
+
+def run_child(args):
+    """
+    Runs one build in this (child) process against the local server and writes its figures.
+    """
+    use_local_site(args.port)
+    import generate
+
+    config = generate.EditionConfig(articles_per_feed=args.articles, sections=_sections(args.sections),
+                                    output_dir=Path("output"), formats=("epub",))
+    result = generate.build_edition(config)
+    Path(args.result).write_text(json.dumps({
+        "chapters": result["chapters"],
+        "epub_bytes": result["epub"].stat().st_size,
+        "build_seconds": result["seconds"],
+    }))
+
+
+def measure(scenario, workdir, port, log):
+    """
+    Builds once in a child process. Returns the scenario's figures.
+    """
+    result_file = Path(workdir) / "result.json"
+    cmd = [sys.executable, __file__, "--child", "--port", str(port), "--articles", str(scenario["articles"]),
+           "--result", str(result_file)]
+    if scenario["sections"]:
+        cmd += ["--sections", scenario["sections"]]
+    env = {**os.environ, "CACHE_DIR": str(Path(workdir) / "cache"), "OUTPUT_FORMATS": "epub",
+           "BUILD_REPORTS_DIR": str(Path(workdir) / "reports")}
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 gives this child's own rusage (plus its reaped children, i.e. the process pool)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"build failed for {scenario['name']} (see {log.name})")
+
+    figures = json.loads(result_file.read_text())
+    return {
+        "wall_seconds": round(wall, 2),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 2),
+        # ru_maxrss is KB on Linux, bytes on macOS
+        "peak_rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        **figures,
+    }
+
+
+def run_benchmarks(args):
+    site = RecordedSite(args.fixtures) if args.fixtures else SyntheticSite()
+    server = LocalSite(site, latency=args.latency, bandwidth=args.bandwidth).start()
+    scenarios = [{"name": f"{n} per feed", "articles": n, "sections": args.sections}
+                 for n in (int(a) for a in args.articles.split(","))]
+    print(f"Serving {'fixtures from ' + args.fixtures if args.fixtures else 'synthetic site'} on port {server.port} "
+          f"(latency {args.latency * 1000:.0f}ms, bandwidth {_bandwidth(args.bandwidth)})")
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="bench-build-") as tmp:
+        log_path = Path(tmp) / "builds.log"
+        with open(log_path, "w") as log:
+            for scenario in scenarios:
+                workdir = Path(tmp) / scenario["name"].replace(" ", "-")
+                workdir.mkdir()
+                for run in (["cold", "warm"] if args.warm else ["cold"]):
+                    before = server.requests
+                    figures = measure(scenario, workdir, server.port, log)
+                    rows.append({"scenario": scenario["name"], "run": run, "requests": server.requests - before, **figures})
+                    _print_row(rows[-1], header=len(rows) == 1)
+        if args.keep_log:
+            Path(args.keep_log).write_text(log_path.read_text())
+    server.stop()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "latency": args.latency, "bandwidth": args.bandwidth, "fixtures": args.fixtures, "results": rows,
+        }, indent=1))
+        print(f"\nResults written to {args.json}")
+
+
+def record(args):
+    """
+    Runs one live build and saves every response it receives under args.fixtures.
+    """
+    import http_client
+    from requests.adapters import HTTPAdapter
+
+    class RecordingAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            r = super().send(request, **kwargs)
+            headers = {k: v for k, v in r.headers.items() if k.lower() in ("content-type", "location")}
+            save_fixture(args.fixtures, request.url, r.status_code, headers, r.content)
+            return r
+
+    adapter = RecordingAdapter(pool_connections=http_client.POOL_HOSTS, pool_maxsize=http_client.POOL_SIZE,
+                               max_retries=http_client._retry_policy())
+    http_client._session.mount("https://", adapter)
+    http_client._session.mount("http://", adapter)
+
+    args.fixtures = os.path.abspath(args.fixtures)
+    with tempfile.TemporaryDirectory(prefix="bench-record-") as tmp:
+        # Fresh caches: every url has to be requested so it gets recorded
+        os.environ["CACHE_DIR"] = str(Path(tmp) / "cache")
+        os.chdir(tmp)
+        import generate
+
+        generate.build_edition(generate.EditionConfig(articles_per_feed=args.articles, output_dir=Path("output"),
+                                                      formats=("epub",)))
+    print(f"Recorded fixtures in {args.fixtures}")
+
+
+def _sections(raw):
+    return [s.strip() for s in raw.split(",") if s.strip()] if raw else None
+
+
+def _bandwidth(bps):
+    return f"{bps / 1e6:.1f} MB/s" if bps else "unlimited"
+
+
+def _print_row(row, header=False):
+    if header:
+        print(f"\n{'scenario':<14}{'run':<6}{'wall':>8}{'cpu':>8}{'peak RSS':>11}{'EPUB':>10}{'chapters':>10}{'requests':>10}")
+    print(f"{row['scenario']:<14}{row['run']:<6}{row['wall_seconds']:>7.2f}s{row['cpu_seconds']:>7.2f}s"
+          f"{row['peak_rss_mb']:>8.1f} MB{row['epub_bytes'] / 1024:>7.0f} KB{row['chapters']:>10}{row['requests']:>10}")
+
+
+def main():
+    argv = sys.argv[1:]
+    mode = argv.pop(0) if argv and argv[0] == "record" else "run"
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    if mode == "record":
+        parser.add_argument("fixtures", help="directory to save responses in")
+    parser.add_argument("--articles", default="1,5,20" if mode == "run" else "5",
+                        help="articles per feed; comma-separated for several scenarios")
+    parser.add_argument("--sections", default="", help="comma-separated sections (default: all)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added before each response")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes/second per response (0 = unlimited)")
+    parser.add_argument("--fixtures", default=None, help="serve responses recorded with `record` from this directory")
+    parser.add_argument("--warm", action="store_true", help="also rebuild each scenario on warm caches")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--keep-log", default=None, help="save the builds' output to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        args.articles = int(args.articles)
+        run_child(args)
+    elif mode == "record":
+        args.articles = int(args.articles)
+        record(args)
+    else:
+        run_benchmarks(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compares the lxml single-pass cleaner against the previous BeautifulSoup ("html.parser")
+cleanup on article pages, and readability against the site fast path (site_extractors).
+
+    python benchmarks/bench_cleaner.py [iterations] [page.html:source ...]
+
+Without page arguments it uses the fixtures in benchmarks/fixtures/. These are synthetic pages
+written in roughly the Guardian and BBC markup, so they show relative costs only. For
+real-world numbers, pass pages saved from the live sites (e.g. from a `bench_build.py record`
+directory).
+"""
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bs4 import BeautifulSoup
+from readability import Document
+
+import site_extractors
+from cleaner import clean_html
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+DEFAULT_PAGES = [
+    (FIXTURES / "guardian-article.html", "guardian"),
+    (FIXTURES / "bbc-article.html", "bbc"),
+]
+
+
+def soup_clean(markup, source):
+    """
+    The BeautifulSoup path as it was before cleaner.py: one find_all pass per rule.
+    """
+    soup = BeautifulSoup(markup, "html.parser")
+    if source == "guardian":
+        for svg in soup.find_all("svg"):
+            svg.decompose()
+    elif source == "bbc":
+        for div in soup.find_all("div", attrs={"data-component": "text-block"}):
+            if div.get_text().strip() == "Related Topics":
+                div.decompose()
+        for fig in soup.find_all("figure", class_="media-player"):
+            fig.decompose()
+    return str(soup)
+
+
+def timed(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - started) / iterations * 1000, result
+
+
+def main():
+    args = sys.argv[1:]
+    iterations = int(args.pop(0)) if args and args[0].isdigit() else 50
+    pages = DEFAULT_PAGES
+    if args:
+        pages = [(Path(a.rsplit(":", 1)[0]), a.rsplit(":", 1)[1] if ":" in a else None) for a in args]
+
+    print(f"{'page':<28}{'readability':>13}{'soup':>10}{'lxml':>10}{'speedup':>9}{'out KB':>14}{'fast path':>12}")
+    for path, source in pages:
+        raw = path.read_bytes()
+        readability_ms, summary = timed(lambda: Document(raw).summary(), max(1, iterations // 5))
+        soup_ms, soup_out = timed(lambda: soup_clean(summary, source), iterations)
+        lxml_ms, lxml_out = timed(lambda: clean_html(summary, source), iterations)
+        fast_ms, fast = timed(lambda: site_extractors.extract(source, raw), iterations)
+        sizes = f"{len(soup_out) // 1024}/{len(lxml_out) // 1024}"
+        # The fast path replaces readability and the cleanup together
+        fast_col = f"{fast_ms:.2f}ms" if fast is not None else "n/a"
+        print(f"{path.name:<28}{readability_ms:>11.2f}ms{soup_ms:>8.2f}ms{lxml_ms:>8.2f}ms"
+              f"{soup_ms / lxml_ms:>8.1f}x{sizes:>14}{fast_col:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Checks and times Send to Kindle delivery offline, against a local SMTP sink.
+
+    python benchmarks/bench_delivery.py [--sections 4] [--articles 6] [--image-kb 120]
+                                        [--max-mb 1] [--epub EDITION.epub] [--json results.json]
+
+Builds a synthetic edition (or takes --epub), then sends it through email_service's
+DeliveryQueue twice, one delivery after the other: first to two Kindle addresses, then to
+a third. The sink records every connection and message. The run fails unless:
+
+- one SMTP session carried every message of both deliveries (a single connection),
+- the first delivery went out as one transaction for both recipients, with neither address
+  shown in the To header,
+- each attachment received is byte-for-byte the volume file that was sent, and
+- the volumes together hold every chapter and image of the edition, byte for byte.
+"""
+import argparse
+import email
+import hashlib
+import io
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+RECIPIENTS = ["first@kindle.com", "second@kindle.com"]
+OVERRIDE = "third@kindle.com"
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    Minimal SMTP server on an ephemeral local port: accepts every message (no TLS, no auth)
+    and keeps (mail from, recipients, data) for each, plus a count of connections.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, text):
+        self.wfile.write(text.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply("220 localhost delivery benchmark sink")
+        mail_from, rcpts = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif verb in ("HELO", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "RSET":
+                mail_from, rcpts = None, []
+                self.reply("250 OK")
+            elif verb == "MAIL":
+                mail_from, rcpts = command.split(":", 1)[1].strip(" <>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcpts.append(command.split(":", 1)[1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                with self.server.lock:
+                    self.server.messages.append((mail_from, rcpts, data))
+                mail_from, rcpts = None, []
+                self.reply("250 OK queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if line in (b".\r\n", b""):
+                return b"".join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+
+def make_edition(path, sections, articles, image_kb):
+    """
+    Writes a synthetic edition: sections x articles chapters, each with one incompressible
+    image of image_kb KB, so the file is big enough to need splitting.
+    """
+    from epub_writer import StreamingEpub
+
+    book = StreamingEpub(path, "bench-delivery", "Delivery benchmark", language="en")
+    book.add_style("style/main.css", "body { font-family: serif; }")
+    toc, spine = [], []
+    for s in range(sections):
+        chapters = []
+        for a in range(articles):
+            data = os.urandom(image_kb * 1024)
+            image = book.add_image(f"img-{s}x{a}", f"images/{s}x{a}.jpg", data)
+            body = f'<img src="{image}"/>' + f"<p>Paragraph of section {s}, article {a}.</p>" * 40
+            chapters.append(book.add_chapter(f"Section {s} story {a}", f"section{s}-{a}.xhtml", body))
+        toc.append((f"Section {s}", chapters))
+        spine.extend(chapters)
+    cover = book.add_chapter("Cover", "cover.xhtml", "<h1>Delivery benchmark</h1>")
+    book.finalize([cover] + toc, [cover] + spine)
+    return path
+
+
+def wait(delivery, timeout=120):
+    started = time.perf_counter()
+    while delivery.status in ("queued", "sending"):
+        if time.perf_counter() - started > timeout:
+            raise TimeoutError(f"delivery {delivery.id} still {delivery.status}")
+        time.sleep(0.02)
+    return time.perf_counter() - started
+
+
+def attachment(data):
+    message = email.message_from_bytes(data)
+    part = next(p for p in message.walk() if p.get_filename())
+    return message, part.get_filename(), part.get_payload(decode=True)
+
+
+def book_contents(archive):
+    """
+    {name: bytes} of an edition's chapters and images (not its cover or package files).
+    """
+    from epub_writer import EPUB_ROOT, read_toc
+
+    names = {EPUB_ROOT + file_name for _, chapters in read_toc(archive) for _, file_name in chapters}
+    names |= {n for n in archive.namelist() if n.startswith(EPUB_ROOT + "images/")}
+    return {name: archive.read(name) for name in names}
+
+
+def run(args, workdir):
+    # Everything the delivery path caches (split volumes) goes into the scratch directory
+    os.environ["CACHE_DIR"] = str(Path(workdir) / "cache")
+    sink = SmtpSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    os.environ.update(SMTP_SERVER="127.0.0.1", SMTP_PORT=str(sink.port), SMTP_STARTTLS="0",
+                      SMTP_FROM="editions@example.com", SMTP_USER="", SMTP_PASSWORD="",
+                      KINDLE_EMAIL=", ".join(RECIPIENTS))
+    import email_service
+    import metrics
+
+    edition = Path(args.epub) if args.epub else make_edition(Path(workdir) / "edition.epub", args.sections,
+                                                             args.articles, args.image_kb)
+    max_bytes = int(args.max_mb * 1024 * 1024)
+    print(f"Edition {edition.name}: {edition.stat().st_size / 1024:.0f} KB, limit {max_bytes / 1024:.0f} KB "
+          f"per email, SMTP sink on port {sink.port}")
+
+    queue = email_service.DeliveryQueue(max_bytes=max_bytes)
+    first = queue.submit(edition)
+    first_seconds = wait(first)
+    second = queue.submit(edition, OVERRIDE)
+    second_seconds = wait(second)
+
+    checks = {}
+    checks["both deliveries sent"] = first.status == "sent" and second.status == "sent"
+    parts = first.files
+    checks["edition split into volumes"] = len(parts) > 1 or edition.stat().st_size <= max_bytes
+    checks["one SMTP session for every message"] = sink.connections == 1
+    checks["one message per volume per delivery"] = len(sink.messages) == 2 * len(parts)
+
+    first_messages, second_messages = sink.messages[:len(parts)], sink.messages[len(parts):]
+    checks["first delivery: both recipients in each transaction"] = all(
+        sorted(rcpts) == sorted(RECIPIENTS) for _, rcpts, _ in first_messages)
+    checks["first delivery: recipients hidden from each other"] = all(
+        attachment(data)[0]["To"] == "undisclosed-recipients:;" for _, _, data in first_messages)
+    checks["second delivery: override address only"] = all(rcpts == [OVERRIDE] for _, rcpts, _ in second_messages)
+
+    sent = {p.name: p.read_bytes() for p in parts}
+    received = [attachment(data)[1:] for _, _, data in sink.messages]
+    checks["attachments match the sent volumes byte for byte"] = all(
+        name in sent and payload == sent[name] for name, payload in received)
+
+    with zipfile.ZipFile(edition) as archive:
+        expected = book_contents(archive)
+    reassembled = {}
+    for name, payload in received[:len(parts)]:
+        with zipfile.ZipFile(io.BytesIO(payload)) as volume:
+            if volume.testzip() is not None:
+                reassembled = None
+                break
+            for member, data in book_contents(volume).items():
+                reassembled.setdefault(member, data)
+    checks["volumes reassemble to the edition's chapters and images"] = reassembled == expected
+
+    with metrics._lock:
+        totals = {name: list(total) for name, total in metrics.TOTALS.items()}
+    sent_bytes = sum(len(data) for _, _, data in sink.messages)
+    results = {
+        "edition_bytes": edition.stat().st_size,
+        "max_bytes": max_bytes,
+        "volumes": [{"name": p.name, "bytes": p.stat().st_size,
+                     "sha256": hashlib.sha256(sent[p.name]).hexdigest()} for p in parts],
+        "connections": sink.connections,
+        "messages": len(sink.messages),
+        "message_bytes": sent_bytes,
+        "first_delivery_seconds": round(first_seconds, 3),
+        "second_delivery_seconds": round(second_seconds, 3),
+        "smtp_connect": {"calls": totals.get("smtp_connect", [0, 0])[1],
+                         "seconds": round(totals.get("smtp_connect", [0.0])[0], 4)},
+        "smtp_send": {"calls": totals.get("smtp_send", [0, 0])[1],
+                      "seconds": round(totals.get("smtp_send", [0.0])[0], 4)},
+        "checks": checks,
+    }
+    sink.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, default=4, help="sections in the synthetic edition")
+    parser.add_argument("--articles", type=int, default=6, help="articles per section")
+    parser.add_argument("--image-kb", type=int, default=120, help="size of each article's image")
+    parser.add_argument("--max-mb", type=float, default=1.0, help="largest email to send (KINDLE_MAX_MB)")
+    parser.add_argument("--epub", default=None, help="deliver this edition instead of a synthetic one")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-delivery-") as workdir:
+        results = run(args, workdir)
+
+    print(f"\n{'volume':<40}{'bytes':>12}")
+    for volume in results["volumes"]:
+        print(f"{volume['name']:<40}{volume['bytes']:>12}")
+    print(f"\n{results['messages']} messages ({results['message_bytes'] / 1024:.0f} KB) over "
+          f"{results['connections']} connection(s); "
+          f"connect {results['smtp_connect']['calls']}x {results['smtp_connect']['seconds'] * 1000:.1f} ms, "
+          f"send {results['smtp_send']['calls']}x {results['smtp_send']['seconds'] * 1000:.1f} ms; "
+          f"deliveries took {results['first_delivery_seconds']:.2f}s and {results['second_delivery_seconds']:.2f}s\n")
+    for name, ok in results["checks"].items():
+        print(f"{'✔' if ok else '✘'} {name}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    sys.exit(0 if all(results["checks"].values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+A local stand-in for the Guardian, BBC and Hacker News sites, used by bench_build.py.
+
+Every request the pipeline makes is rewritten by RewriteAdapter from
+https://host/path?query to http://127.0.0.1:PORT/host/path?query and answered by
+LocalSite, either from a recorded fixture directory (see `bench_build.py record`) or
+from a deterministic synthetic site built from the article pages in fixtures/. Those pages
+are synthetic too (filler text in roughly the Guardian and BBC markup, not saved copies), so
+timings against this site say how the pipeline behaves, not how fast real pages are.
+Latency and bandwidth are injected per response so network conditions are repeatable.
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+ITEMS_PER_FEED = 30
+HN_STORIES = 100
+HN_COMMENTS_PER_STORY = 60
+
+
+class SyntheticSite:
+    """
+    Fake of every url the pipeline requests, with the same structure on every run. Content is
+    generated on first request and kept, so later runs in the session see identical bytes
+    (and ETags).
+    """
+
+    def __init__(self):
+        self.guardian_page = (FIXTURES / "guardian-article.html").read_text()
+        self.bbc_page = (FIXTURES / "bbc-article.html").read_text()
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            response = self._cache.get(url)
+        if response is None:
+            response = self._build(url)
+            with self._lock:
+                response = self._cache.setdefault(url, response)
+        return response
+
+    def _build(self, url):
+        parts = urlsplit(url)
+        host, path = parts.netloc, parts.path
+        if host == "www.theguardian.com" and path.endswith("/rss"):
+            return self._guardian_feed(path.strip("/").rsplit("/", 1)[0])
+        if host == "feeds.bbci.co.uk":
+            return self._bbc_feed()
+        if host == "www.theguardian.com":
+            return 200, {"Content-Type": "text/html; charset=utf-8"}, self._article(self.guardian_page, path)
+        if host == "www.bbc.co.uk":
+            return 200, {"Content-Type": "text/html; charset=utf-8"}, self._article(self.bbc_page, path)
+        if host in ("i.guim.co.uk", "ichef.bbci.co.uk"):
+            return 200, {"Content-Type": "image/jpeg"}, _jpeg(url)
+        if host == "hacker-news.firebaseio.com":
+            return self._hn(path)
+        return 404, {"Content-Type": "text/plain"}, b"not found"
+
+    def _guardian_feed(self, section):
+        items = []
+        for i in range(ITEMS_PER_FEED):
+            # Scotland shares its first stories with UK News, as the real feeds often do
+            link_section = "uk-news" if section == "uk/scotland" and i < 3 else section
+            link = f"https://www.theguardian.com/{link_section}/2026/oct/16/story-{i}"
+            media = "".join(
+                f'<media:content width="{w}" url="https://i.guim.co.uk/img/{link_section}/{i}.jpg?width={w}"/>'
+                for w in (140, 460, 1200))
+            items.append(f"<item><title>{link_section} story {i}</title><link>{link}</link><guid>{link}</guid>"
+                         f"<pubDate>Fri, 16 Oct 2026 {i % 24:02d}:00:00 GMT</pubDate>{media}</item>")
+        return 200, {"Content-Type": "application/rss+xml"}, _rss(section, items)
+
+    def _bbc_feed(self):
+        items = []
+        for i in range(ITEMS_PER_FEED):
+            kind = "live" if i % 7 == 3 else "articles"
+            link = f"https://www.bbc.co.uk/news/{kind}/c{i:04d}"
+            thumb = f'<media:thumbnail width="240" url="https://ichef.bbci.co.uk/news/240/{i}.jpg"/>'
+            items.append(f"<item><title>BBC story {i}</title><link>{link}</link><guid>{link}</guid>"
+                         f"<pubDate>Fri, 16 Oct 2026 {i % 24:02d}:30:00 GMT</pubDate>{thumb}</item>")
+        return 200, {"Content-Type": "application/rss+xml"}, _rss("BBC News", items)
+
+    def _article(self, page, path):
+        title = path.rstrip("/").rsplit("/", 1)[-1].replace("-", " ").capitalize()
+        return page.replace("Fixture headline", f"{title} ({path})").encode("utf-8")
+
+    def _hn(self, path):
+        if path.endswith("/topstories.json"):
+            return 200, {"Content-Type": "application/json"}, json.dumps(list(range(1000, 1000 + HN_STORIES))).encode()
+        item_id = int(path.rsplit("/", 1)[-1].split(".")[0])
+        if item_id < 10_000:
+            item = {"id": item_id, "type": "story", "by": "poster", "title": f"HN story {item_id}",
+                    "url": f"https://example.com/{item_id}", "time": 1792108800,
+                    "kids": [item_id * 100 + k for k in range(HN_COMMENTS_PER_STORY)]}
+        else:
+            depth = len(str(item_id)) - 6
+            item = {"id": item_id, "type": "comment", "by": f"user{item_id % 97}", "time": 1792108800,
+                    "text": f"<p>Comment {item_id}.</p><p>{'Some thoughtful words &amp; a link. ' * 8}</p>",
+                    "kids": [item_id * 10 + k for k in range(3)] if depth < 2 else []}
+        return 200, {"Content-Type": "application/json"}, json.dumps(item).encode()
+
+
+class RecordedSite:
+    """
+    Serves responses saved by `bench_build.py record` from a fixture directory. Redirects are
+    replayed as recorded, so the client follows them back through the local server.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def get(self, url):
+        path = fixture_path(self.root, url)
+        try:
+            meta = json.loads(path.with_name(path.name + ".json").read_text())
+            return meta["status"], meta["headers"], path.read_bytes()
+        except OSError:
+            return 404, {"Content-Type": "text/plain"}, b"not recorded"
+
+
+def fixture_path(root, url):
+    parts = urlsplit(url)
+    name = quote(parts.path.lstrip("/") + (f"?{parts.query}" if parts.query else ""), safe="")
+    return Path(root) / parts.netloc / (name or "index")
+
+
+def save_fixture(root, url, status, headers, body):
+    """
+    Stores one response; headers should hold Content-Type and, for redirects, Location.
+    """
+    path = fixture_path(root, url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(body)
+    path.with_name(path.name + ".json").write_text(json.dumps({"url": url, "status": status, "headers": headers}))
+
+
+def _rss(title, items):
+    return (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/">'
+            f'<channel><title>{title}</title>{"".join(items)}</channel></rss>').encode("utf-8")
+
+
+def _jpeg(url):
+    """
+    A photo-sized JPEG with enough noise to cost a realistic amount to decode and re-encode.
+    """
+    from PIL import Image
+
+    seed = int(hashlib.sha1(url.encode()).hexdigest()[:6], 16)
+    noise = Image.effect_noise((1200, 800), 40 + seed % 40)
+    gradient = Image.linear_gradient("L").resize((1200, 800))
+    im = Image.merge("RGB", (noise, gradient, Image.blend(noise, gradient, 0.5)))
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=88)
+    return buf.getvalue()
+
+
+class LocalSite:
+    """
+    Threaded HTTP server for a site (SyntheticSite or RecordedSite) with injected latency
+    (seconds before the first byte) and bandwidth (bytes/second per response, 0 = unlimited).
+    """
+
+    def __init__(self, site, latency=0.0, bandwidth=0):
+        self.site = site
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                host, _, rest = self.path.lstrip("/").partition("/")
+                status, headers, body = server.site.get(f"https://{host}/{rest}")
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+                time.sleep(server.latency)
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", formatdate(1792108800, usegmt=True))
+                self.end_headers()
+                self._send_body(body)
+
+            def _send_body(self, body):
+                if not server.bandwidth:
+                    self.wfile.write(body)
+                    return
+                chunk = max(1024, server.bandwidth // 20)
+                for offset in range(0, len(body), chunk):
+                    self.wfile.write(body[offset:offset + chunk])
+                    time.sleep(min(chunk, len(body) - offset) / server.bandwidth)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RewriteAdapter(HTTPAdapter):
+    """
+    Sends every request to the local server instead of the real host, keeping the original
+    host as the first path segment.
+    """
+
+    def __init__(self, port, **kwargs):
+        self.port = port
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        query = f"?{parts.query}" if parts.query else ""
+        request.url = f"http://127.0.0.1:{self.port}/{parts.netloc}{parts.path}{query}"
+        request.headers.pop("Host", None)
+        return super().send(request, **kwargs)
+
+
+def use_local_site(port):
+    """
+    Points the shared HTTP client at the local server (pool size and retries unchanged).
+    """
+    import http_client
+
+    adapter = RewriteAdapter(port, pool_connections=http_client.POOL_HOSTS, pool_maxsize=http_client.POOL_SIZE,
+                             max_retries=http_client._retry_policy())
+    http_client._session.mount("https://", adapter)
+    http_client._session.mount("http://", adapter)
+    http_client._adapter = adapter
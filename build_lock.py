@@ -0,0 +1,51 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+# One build at a time per output directory, across processes: the web app's worker and the
+# cron job (python generate.py) both take this lock, so a scheduled run can never overlap a
+# manual one.
+LOCK_NAME = ".build.lock"
+
+
+class BuildLocked(Exception):
+    """
+    Another process holds the build lock (raised when not waiting for it).
+    """
+
+
+def lock_path(output_dir):
+    return Path(output_dir) / LOCK_NAME
+
+
+def holder(output_dir):
+    """
+    Returns the pid recorded by the current (or last) lock holder, or None.
+    """
+    try:
+        return int(lock_path(output_dir).read_text().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def hold(output_dir, blocking=True):
+    """
+    Holds the build lock for output_dir. With blocking=False raises BuildLocked instead of waiting.
+    """
+    path = lock_path(output_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            raise BuildLocked(f"build already running (pid {holder(output_dir)})") from None
+        try:
+            f.seek(0)
+            f.truncate()
+            f.write(str(os.getpid()))
+            f.flush()
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
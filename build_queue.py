@@ -0,0 +1,203 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+import build_lock
+import generate
+
+# Builds requested by the web app (form, scheduler, /jobs API) go through one queue served by
+# BUILD_WORKERS threads. A request identical to one already queued or running gets that job
+# back instead of a second build.
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "1"))
+JOB_HISTORY = 50
+# Progress events kept per job for subscribers that connect late or reconnect
+JOB_EVENTS = 500
+
+
+class Job:
+    """
+    One requested build and its progress. Updated by the worker, read by the /jobs API.
+    Every change is also appended to events, which subscribers follow with wait_events().
+    """
+
+    def __init__(self, config, source, skip_if_locked=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.config = config
+        self.source = source
+        self.skip_if_locked = skip_if_locked
+        self.status = "queued"
+        self.progress = 0
+        self.message = "Waiting in queue..."
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.requests = 1
+        self.events = deque(maxlen=JOB_EVENTS)
+        self._seq = 0
+        self._changed = threading.Condition()
+        self._emit()
+
+    @property
+    def key(self):
+        return config_key(self.config)
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def update(self, progress, message, **detail):
+        """
+        Progress callback for the build (see generate.EditionConfig.progress). detail may name
+        the section and article just processed.
+        """
+        self.progress = max(self.progress, min(100, int(progress)))
+        self.message = message
+        self._emit(**detail)
+
+    def set_status(self, status, message=None):
+        self.status = status
+        if message is not None:
+            self.message = message
+        self._emit()
+
+    def _emit(self, **detail):
+        with self._changed:
+            self._seq += 1
+            self.events.append({"seq": self._seq, "status": self.status, "progress": self.progress,
+                                "message": self.message, **detail})
+            self._changed.notify_all()
+
+    def wait_events(self, after=0, timeout=None):
+        """
+        Returns the events newer than seq `after`, waiting up to timeout seconds for one
+        (an empty list on timeout). Events pushed out of the history are skipped.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._seq > after, timeout)
+            return [event for event in self.events if event["seq"] > after]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "source": self.source,
+            "articles_per_feed": self.config.articles_per_feed,
+            "sections": self.config.sections,
+            "requests": self.requests,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def config_key(config):
+    sections = tuple(sorted(config.sections)) if config.sections is not None else None
+    return (config.articles_per_feed, sections, str(config.output_dir), tuple(config.formats))
+
+
+class BuildQueue:
+    """
+    FIFO of build jobs with request coalescing. on_complete(job) runs after each successful build.
+    """
+
+    def __init__(self, workers=BUILD_WORKERS, on_complete=None):
+        self.on_complete = on_complete
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        for n in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f"build-worker-{n}", daemon=True).start()
+
+    def submit(self, config, source="web", skip_if_locked=False):
+        """
+        Queues a build for config (a generate.EditionConfig) and returns its Job, or the
+        already queued/running Job for an identical config. skip_if_locked drops the job when
+        another process is building (for scheduled runs that cron may already be doing).
+        """
+        key = config_key(config)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.active and job.key == key:
+                    job.requests += 1
+                    print(f"Build request coalesced into job {job.id} ({source})")
+                    return job
+            job = Job(config, source, skip_if_locked)
+            self._jobs[job.id] = job
+            self._trim()
+        self._queue.put(job)
+        print(f"Build job {job.id} queued ({source})")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """
+        Known jobs, newest first.
+        """
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def current(self):
+        """
+        The active job to show by default (the oldest one still queued or running), else None.
+        """
+        active = [job for job in self.jobs() if job.active]
+        return active[-1] if active else None
+
+    def _trim(self):
+        finished = sorted((j for j in self._jobs.values() if not j.active), key=lambda j: j.created)
+        for job in finished[:max(0, len(self._jobs) - JOB_HISTORY)]:
+            del self._jobs[job.id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.started = time.time()
+        job.set_status("running", "Starting generation...")
+        job.config.progress = job.update
+        try:
+            try:
+                with build_lock.hold(job.config.output_dir, blocking=False):
+                    result = generate.build_edition(job.config)
+            except build_lock.BuildLocked as e:
+                if job.skip_if_locked:
+                    job.finished = time.time()
+                    job.set_status("skipped", f"Skipped: {e}")
+                    print(f"Build job {job.id} skipped: {e}")
+                    return
+                # Usually the cron job: wait for it rather than building twice at once
+                job.update(0, f"Waiting for another build to finish ({e})...")
+                with build_lock.hold(job.config.output_dir):
+                    result = generate.build_edition(job.config)
+
+            job.result = {"epub": str(result["epub"]), "chapters": result["chapters"],
+                          "dropped": result["dropped"], "seconds": round(result["seconds"], 1)}
+            if self.on_complete is not None:
+                self.on_complete(job)
+            job.progress = 100
+            job.finished = time.time()
+            job.set_status("complete", f"Generation successful! ({result['seconds']:.0f}s)")
+        except Exception as e:
+            job.error = str(e)
+            job.finished = time.time()
+            job.set_status("error", f"Unexpected error: {e}")
+            print(f"⚠ Build job {job.id} failed: {e}")
+        finally:
+            job.config.progress = None
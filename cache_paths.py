@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# Persistent cache root shared by all on-disk caches (feeds, articles, images, HN items,
+# converted formats, volumes). Override with CACHE_DIR in .env.
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+
+
+def write_atomic(path, data):
+    """
+    Writes data to path through a temp file unique to this process and thread, so readers
+    never see a partial file and concurrent writers don't clobber each other's temp files.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    tmp.replace(path)
+
+
+def sqlite_connector(db_path, init):
+    """
+    Returns a connect() for the SQLite database at db_path. The first call in a process
+    creates the directory and runs init(conn) to set up the schema.
+    """
+    ready = False
+
+    def connect():
+        nonlocal ready
+        if not ready:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=10)
+        if not ready:
+            init(conn)
+            conn.commit()
+            ready = True
+        return conn
+
+    return connect
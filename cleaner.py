@@ -0,0 +1,80 @@
+from lxml import etree, html
+
+
+def _is_svg(el):
+    return el.tag == "svg"
+
+
+def _is_script(el):
+    return el.tag in ("script", "style", "noscript")
+
+
+def _is_related_topics(el):
+    # BBC: "Related Topics" / "More on this story" footer blocks
+    return (
+        el.tag == "div"
+        and el.get("data-component") == "text-block"
+        and el.text_content().strip() == "Related Topics"
+    )
+
+
+def _is_rich_link(el):
+    # Guardian: "related" link cards inside the article body
+    return el.tag == "aside" and el.get("data-component") == "rich-link"
+
+
+def _is_video_figure(el):
+    # BBC: leftover video placeholders
+    return el.tag == "figure" and "media-player" in (el.get("class") or "").split()
+
+
+# Elements dropped per source. Every source loses scripts and styles.
+RULES = {
+    "guardian": [_is_script, _is_svg, _is_rich_link],
+    "bbc": [_is_script, _is_related_topics, _is_video_figure],
+}
+DEFAULT_RULES = [_is_script]
+
+
+def clean_html(markup, source=None):
+    """
+    Parses markup once with lxml and returns its body content cleaned by clean_element().
+    """
+    if not markup or not markup.strip():
+        return ""
+
+    root = html.document_fromstring(markup)
+    body = root.find("body")
+    return clean_element(body if body is not None else root, source)
+
+
+def clean_element(container, source=None):
+    """
+    Drops everything matched by the source's rules from container (in place) in a single
+    walk of the tree and returns its content serialised as XHTML.
+    """
+    rules = RULES.get(source, DEFAULT_RULES)
+
+    doomed = []
+    for el in container.iter():
+        if el is container:
+            continue
+        if not isinstance(el.tag, str):
+            # Comments and processing instructions never make it into the chapter
+            doomed.append(el)
+        elif any(rule(el) for rule in rules):
+            doomed.append(el)
+    for el in doomed:
+        if el.getparent() is not None:
+            el.drop_tree()
+
+    parts = [_escape_text(container.text)]
+    for child in container:
+        parts.append(etree.tostring(child, method="xml", encoding="unicode"))
+    return "".join(parts)
+
+
+def _escape_text(text):
+    if not text:
+        return ""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Time budgets that keep a build on schedule. The whole build gets BUILD_BUDGET seconds and
+# each source (Guardian, BBC, HN) its own budget inside it; 0 disables a budget. Fetches
+# clip their timeouts to the time left, the fetch pool stops waiting once it is spent, and
+# whatever finished in time goes into the edition.
+BUILD_BUDGET = float(os.getenv("BUILD_BUDGET", "600"))
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """
+    Work that was started, or would have been, after its budget ran out.
+    """
+
+
+class Deadline:
+    """
+    A named budget that also ends when its parent's does.
+    """
+
+    def __init__(self, name, seconds, parent=None):
+        self.name = name
+        self.seconds = seconds
+        self.parent = parent
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        """
+        Seconds left (0 once expired), or None when neither this nor a parent has a budget.
+        """
+        left = [d.expires - time.monotonic() for d in self._chain() if d.expires is not None]
+        return max(0.0, min(left)) if left else None
+
+    @property
+    def expired(self):
+        return self.remaining() == 0
+
+    def reason(self):
+        """
+        Which budget ran out, e.g. "BBC budget (120s) reached".
+        """
+        for d in self._chain():
+            if d.expires is not None and d.expires <= time.monotonic():
+                return f"{d.name} budget ({d.seconds:g}s) reached"
+        return f"{self.name} budget ({self.seconds:g}s) reached"
+
+    def _chain(self):
+        d = self
+        while d is not None:
+            yield d
+            d = d.parent
+
+
+def current():
+    """
+    The innermost deadline active in this thread, or None.
+    """
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def using(deadline):
+    """
+    Makes deadline the current one in this thread (fetch pool workers run their caller's).
+    """
+    previous = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+@contextmanager
+def limit(name, seconds):
+    """
+    Runs the block under a budget of seconds (0 = none) nested within the current deadline.
+    """
+    with using(Deadline(name, seconds, current())) as deadline:
+        yield deadline
+
+
+def expired():
+    deadline = current()
+    return deadline is not None and deadline.expired
+
+
+def reason():
+    deadline = current()
+    return deadline.reason() if deadline is not None else ""
+
+
+def check():
+    """
+    Raises DeadlineExceeded when the current deadline has passed.
+    """
+    if expired():
+        raise DeadlineExceeded(reason())
+
+
+def clip(timeout):
+    """
+    Returns timeout shortened to the time left, raising DeadlineExceeded when none is.
+    """
+    check()
+    left = current().remaining() if current() is not None else None
+    return timeout if left is None else max(0.1, min(timeout, left))
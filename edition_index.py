@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import formats
+
+# A few-KB summary written next to each EPUB (guardian-DATE.index.json) so the web app can
+# list an edition without opening the archive: titles per section, sizes, timestamps and the
+# EPUB's content hash (its download ETag).
+
+
+def index_path(epub_path):
+    return Path(epub_path).with_suffix(".index.json")
+
+
+def write(epub_path, toc_structure, **extra):
+    """
+    Writes the sidecar for epub_path from the build's [(section, [chapter, ...]), ...].
+    Repeat TOC entries for an article already listed under another section are included.
+    """
+    epub_path = Path(epub_path)
+    stat = epub_path.stat()
+    data = {
+        "edition": epub_path.stem,
+        "epub": epub_path.name,
+        "epub_bytes": stat.st_size,
+        "sha256": formats.epub_hash(epub_path),
+        "built_at": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+        **extra,
+        "sections": [{"name": name, "titles": [chap.title for chap in chapters]} for name, chapters in toc_structure],
+    }
+    path = index_path(epub_path)
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_text(json.dumps(data))
+    tmp.replace(path)
+    return path
+
+
+class EditionCache:
+    """
+    The indexes of the editions in the output directory, kept in memory. get() costs one stat
+    of the directory: it only reloads when the directory changed (new edition, new format,
+    cleanup) or after invalidate() (e.g. when a build completes).
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._editions = []
+        self._hashes = {}
+        self._previous_hashes = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
+
+    def editions(self):
+        """
+        Every edition on disk, newest first.
+        """
+        try:
+            stamp = os.stat(self.output_dir).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            if stamp != self._stamp:
+                self._editions = self._load()
+                self._stamp = stamp
+            return self._editions
+
+    def get(self, date=None):
+        """
+        Returns {"edition", "date", "titles", "sections", "files": {fmt: {"path", "bytes", "etag",
+        "modified"}}, ...} for the newest edition, or the one built for date (YYYY-MM-DD);
+        None when there isn't one.
+        """
+        for edition in self.editions():
+            if date is None or edition["date"] == date:
+                return edition
+        return None
+
+    def _load(self):
+        epubs = sorted(self.output_dir.glob("*.epub"), key=lambda p: p.stat().st_mtime, reverse=True)
+        # Only hashes of files still on disk are carried over
+        self._previous_hashes, self._hashes = self._hashes, {}
+        return [self._load_edition(epub_path) for epub_path in epubs]
+
+    def _load_edition(self, epub_path):
+        try:
+            edition = json.loads(index_path(epub_path).read_text())
+        except (OSError, ValueError):
+            # Built before sidecars existed: downloads still work, the article list is empty
+            edition = {"edition": epub_path.stem, "epub": epub_path.name, "sections": []}
+
+        edition["date"] = edition["edition"][-10:]
+        edition["titles"] = list(dict.fromkeys(t for s in edition["sections"] for t in s["titles"]))
+        edition["files"] = {}
+        for fmt in formats.FORMATS:
+            path = formats.target_path(epub_path, fmt)
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if fmt == "epub" and edition.get("sha256") and stat.st_size == edition.get("epub_bytes"):
+                digest = edition["sha256"]
+            else:
+                digest = self._hash(path, stat)
+            edition["files"][fmt] = {"path": path, "bytes": stat.st_size, "etag": digest[:32],
+                                     "modified": stat.st_mtime}
+        return edition
+
+    def _hash(self, path, stat):
+        # Converted files (and EPUBs without a sidecar hash) are hashed once per version
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._previous_hashes.get(key) or formats.epub_hash(path)
+        self._hashes[key] = digest
+        return digest
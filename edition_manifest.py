@@ -0,0 +1,105 @@
+import json
+import zipfile
+from pathlib import Path
+
+from article_cache import canonical_url
+from epub_writer import EPUB_ROOT
+
+# The manifest sits next to the EPUB (guardian-DATE.manifest.json) and records, per chapter,
+# where it came from and what went into it, so the next run can reuse unchanged chapters
+# straight out of the previous archive instead of fetching and extracting them again.
+
+
+def manifest_path(epub_path):
+    return Path(epub_path).with_suffix(".manifest.json")
+
+
+def entry_fingerprint(entry):
+    """
+    Identifies a feed entry's revision: the url plus whatever the feed says changed.
+    """
+    updated = entry.get("updated") or entry.get("published") or ""
+    return f"{canonical_url(entry.link)}|{updated}|{entry.get('title', '')}"
+
+
+class Manifest:
+    """
+    Collects chapter records (epub_writer.Chapter) while an edition is built.
+    """
+
+    def __init__(self):
+        self.chapters = []
+
+    def add(self, section, chap, url=None, fingerprint=None, image_digests=()):
+        self.chapters.append({
+            "section": section,
+            "title": chap.title,
+            "file_name": chap.file_name,
+            "url": canonical_url(url) if url else None,
+            "fingerprint": fingerprint,
+            "content_hash": chap.content_hash,
+            "images": [{"hash": digest, "file_name": f"images/{digest[:16]}.jpg"} for digest in image_digests],
+        })
+
+    def write(self, epub_path, **meta):
+        path = manifest_path(epub_path)
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"epub": Path(epub_path).name, **meta, "chapters": self.chapters}, indent=1))
+        tmp.replace(path)
+        return path
+
+
+class PreviousEdition:
+    """
+    Read access to the last edition's manifest and archive for chapter reuse.
+    """
+
+    def __init__(self, manifest, archive):
+        self.archive = archive
+        self.by_fingerprint = {c["fingerprint"]: c for c in manifest.get("chapters", []) if c.get("fingerprint")}
+        self.reused = 0
+
+    @classmethod
+    def load(cls, output_dir):
+        """
+        Opens the newest edition in output_dir that has both a manifest and its EPUB, or None.
+        """
+        manifests = sorted(Path(output_dir).glob("*.manifest.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in manifests:
+            try:
+                manifest = json.loads(path.read_text())
+                archive = zipfile.ZipFile(path.parent / manifest["epub"])
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                continue
+            return cls(manifest, archive)
+        return None
+
+    def has(self, entry):
+        """
+        True when entry is unchanged since the previous edition and its files are in the archive.
+        """
+        record = self.by_fingerprint.get(entry_fingerprint(entry))
+        if record is None:
+            return False
+        names = [record["file_name"]] + [img["file_name"] for img in record["images"]]
+        return all(EPUB_ROOT + name in self.archive.NameToInfo for name in names)
+
+    def reuse(self, entry):
+        """
+        Returns (content, [(digest, jpeg_bytes), ...]) for an unchanged entry, or None.
+        The content is the chapter document exactly as it was written last time.
+        """
+        record = self.by_fingerprint.get(entry_fingerprint(entry))
+        if record is None:
+            return None
+        try:
+            # Kept as bytes: lxml refuses str documents that carry an encoding declaration
+            content = self.archive.read(EPUB_ROOT + record["file_name"])
+            images = [(img["hash"], self.archive.read(EPUB_ROOT + img["file_name"])) for img in record["images"]]
+        except (KeyError, OSError, zipfile.BadZipFile):
+            return None
+        self.reused += 1
+        return content, images
+
+    def close(self):
+        self.archive.close()
@@ -1,57 +1,307 @@
-import smtplib
+import base64
 import os
-from email.message import EmailMessage
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email.utils import formatdate, make_msgid
 from pathlib import Path
 from dotenv import load_dotenv
 
+import metrics
+import volumes
+
 # Load environment variables
 load_dotenv()
 
-def send_to_kindle(file_path: Path, override_email: str = None):
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = os.getenv("SMTP_PORT")
-    smtp_user = os.getenv("SMTP_USER")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    
-    # Use override if provided, otherwise env var
-    kindle_email = override_email if override_email else os.getenv("KINDLE_EMAIL")
-
-    if not all([smtp_server, smtp_port, smtp_user, smtp_password, kindle_email]):
-        print("⚠ Email configuration missing (check .env or provide email). Skipping Send to Kindle.")
-        return False
+# Largest email (attachment included, as encoded) to send in one go; bigger editions are split
+# into volumes. Amazon accepts up to 50 MB, but most SMTP providers stop at 25 MB.
+KINDLE_MAX_BYTES = int(float(os.getenv("KINDLE_MAX_MB", "25")) * 1024 * 1024)
+# The SMTP session is kept open between deliveries and closed after this many idle seconds
+SMTP_IDLE = int(os.getenv("SMTP_IDLE", "60"))
+SMTP_TIMEOUT = 60
 
-    if not file_path.exists():
-        print(f"⚠ File {file_path} does not exist. Cannot send.")
-        return False
+SUBJECT = "Convert"  # "Convert" subject helps Amazon convert PDF/HTML if needed, though we send MOBI/EPUB
+BODY = "Here is your daily Guardian digest."
+# Attachment read size: a multiple of 57 bytes, so each chunk encodes to whole 76-character lines
+CHUNK = 57 * 1024
+
+
+def _settings():
+    return {
+        "server": os.getenv("SMTP_SERVER"),
+        "port": os.getenv("SMTP_PORT"),
+        "user": os.getenv("SMTP_USER"),
+        "password": os.getenv("SMTP_PASSWORD"),
+        "sender": os.getenv("SMTP_FROM") or os.getenv("SMTP_USER"),
+        # Off only for a local test server (e.g. `python -m aiosmtpd -n -l localhost:8025`)
+        "starttls": os.getenv("SMTP_STARTTLS", "1") != "0",
+    }
+
+
+def recipients(override_email=None):
+    """
+    The Kindle addresses to deliver to: override_email if given, else KINDLE_EMAIL. Both may
+    list several addresses separated by commas or spaces.
+    """
+    raw = override_email if override_email and override_email.strip() else os.getenv("KINDLE_EMAIL", "")
+    return [addr for addr in raw.replace(",", " ").split() if "@" in addr]
+
+
+class SmtpSession:
+    """
+    One SMTP connection (STARTTLS and login done once) reused for every send until closed.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._smtp = None
+
+    def connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self.close()
+
+        s = self.settings
+        with metrics.stage("smtp_connect"):
+            smtp = smtplib.SMTP(s["server"], int(s["port"]), timeout=SMTP_TIMEOUT)
+            try:
+                if s["starttls"]:
+                    smtp.starttls()
+                if s["user"] and s["password"]:
+                    smtp.login(s["user"], s["password"])
+            except Exception:
+                smtp.close()
+                raise
+        self._smtp = smtp
+        return smtp
+
+    def send(self, file_path, to):
+        """
+        Sends file_path to every address in `to` in a single transaction, streaming the
+        attachment. Returns {address: refusal} for any recipients the server refused.
+        """
+        try:
+            return self._send(self.connection(), file_path, to)
+        except smtplib.SMTPServerDisconnected:
+            # Dropped while idle between our check and the send: one retry on a new connection
+            self.close()
+            return self._send(self.connection(), file_path, to)
+
+    def _send(self, smtp, file_path, to):
+        with metrics.stage("smtp_send"):
+            smtp.ehlo_or_helo_if_needed()
+            code, resp = smtp.mail(self.settings["sender"])
+            if code != 250:
+                smtp.rset()
+                raise smtplib.SMTPSenderRefused(code, resp, self.settings["sender"])
+            refused = {}
+            for addr in to:
+                code, resp = smtp.rcpt(addr)
+                if code not in (250, 251):
+                    refused[addr] = (code, resp)
+            if len(refused) == len(to):
+                smtp.rset()
+                raise smtplib.SMTPRecipientsRefused(refused)
+
+            code, resp = smtp.docmd("data")
+            if code != 354:
+                raise smtplib.SMTPDataError(code, resp)
+            for chunk in message_chunks(file_path, self.settings["sender"], to):
+                smtp.send(chunk)
+            smtp.send(b".\r\n")
+            code, resp = smtp.getreply()
+            if code != 250:
+                raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
 
-    print(f"📧 Sending {file_path.name} to {kindle_email}...")
 
-    msg = EmailMessage()
-    msg['Subject'] = "Convert"  # "Convert" subject helps Amazon convert PDF/HTML if needed, though we send MOBI/EPUB
-    msg['From'] = smtp_user
-    msg['To'] = kindle_email
-    msg.set_content("Here is your daily Guardian digest.")
+def message_chunks(file_path, sender, to):
+    """
+    Yields the email with file_path attached, ready for the SMTP DATA phase (CRLF line endings,
+    dot-stuffed). The attachment is read and base64-encoded a chunk at a time.
+    """
+    file_path = Path(file_path)
+    boundary = f"=={uuid.uuid4().hex}"
+    content_type = "application/epub+zip" if file_path.suffix == ".epub" else "application/octet-stream"
+    headers = [
+        f"From: {sender}",
+        # Recipients don't see each other's Kindle addresses
+        f"To: {to[0]}" if len(to) == 1 else "To: undisclosed-recipients:;",
+        f"Subject: {SUBJECT}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {make_msgid()}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        f"--{boundary}",
+        'Content-Type: text/plain; charset="utf-8"',
+        "Content-Transfer-Encoding: 7bit",
+        "",
+        BODY,
+        f"--{boundary}",
+        f'Content-Type: {content_type}; name="{file_path.name}"',
+        f'Content-Disposition: attachment; filename="{file_path.name}"',
+        "Content-Transfer-Encoding: base64",
+        "",
+    ]
+    # Our own lines never start with "." but are stuffed anyway; base64 lines can't
+    yield "".join(("." + line if line.startswith(".") else line) + "\r\n" for line in headers).encode("utf-8")
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            yield base64.encodebytes(block).replace(b"\n", b"\r\n")
+    yield f"--{boundary}--\r\n".encode("ascii")
 
-    # Read and attach file
-    with open(file_path, 'rb') as f:
-        file_data = f.read()
-        msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_path.name)
 
+class Delivery:
+    """
+    One requested Send to Kindle: an edition going to one or more addresses.
+    """
+
+    def __init__(self, file_path, to):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_path = Path(file_path)
+        self.to = to
+        self.status = "queued"
+        self.message = "Waiting to be sent..."
+        self.files = []
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "file": self.file_path.name,
+            "to": self.to,
+            "status": self.status,
+            "message": self.message,
+            "files": [p.name for p in self.files],
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class DeliveryQueue:
+    """
+    Sends deliveries one after another in a background thread over a shared SMTP session,
+    which is closed once the queue has been idle for SMTP_IDLE seconds.
+    """
+
+    HISTORY = 50
+
+    def __init__(self, max_bytes=KINDLE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue()
+        self._deliveries = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._work, name="kindle-delivery", daemon=True).start()
+
+    def submit(self, file_path, override_email=None):
+        """
+        Queues file_path for the given (or default) Kindle addresses and returns its Delivery,
+        which is already failed when email isn't configured.
+        """
+        delivery = Delivery(file_path, recipients(override_email))
+        with self._lock:
+            self._deliveries[delivery.id] = delivery
+            for old in list(self._deliveries)[:-self.HISTORY]:
+                del self._deliveries[old]
+
+        settings = _settings()
+        if not all([settings["server"], settings["port"], settings["sender"], delivery.to]):
+            print("⚠ Email configuration missing (check .env or provide email). Skipping Send to Kindle.")
+            delivery.status, delivery.message = "error", "Email is not configured"
+            return delivery
+        self._queue.put(delivery)
+        print(f"📧 Queued {delivery.file_path.name} for {', '.join(delivery.to)}")
+        return delivery
+
+    def get(self, delivery_id):
+        with self._lock:
+            return self._deliveries.get(delivery_id)
+
+    def _work(self):
+        session = None
+        while True:
+            try:
+                delivery = self._queue.get(timeout=SMTP_IDLE if session is not None else None)
+            except queue.Empty:
+                session.close()
+                session = None
+                continue
+            settings = _settings()
+            if session is None or session.settings != settings:
+                if session is not None:
+                    session.close()
+                session = SmtpSession(settings)
+            deliver(delivery, session, self.max_bytes)
+
+
+def deliver(delivery, session, max_bytes=KINDLE_MAX_BYTES):
+    """
+    Sends a delivery's edition (split into volumes when too big for one email) over session.
+    Returns True when every part reached at least one recipient.
+    """
+    delivery.status = "sending"
     try:
-        with smtplib.SMTP(smtp_server, int(smtp_port)) as s:
-            s.starttls()
-            s.login(smtp_user, smtp_password)
-            s.send_message(msg)
-        print("✔ Email sent successfully!")
+        if not delivery.file_path.exists():
+            raise FileNotFoundError(f"{delivery.file_path} does not exist")
+        delivery.files = volumes.split(delivery.file_path, max_bytes)
+        refused = {}
+        for n, part in enumerate(delivery.files, start=1):
+            delivery.message = f"Sending {part.name} ({n}/{len(delivery.files)})..."
+            print(f"📧 Sending {part.name} to {', '.join(delivery.to)}...")
+            refused.update(session.send(part, delivery.to))
+        delivery.status = "sent"
+        delivery.message = f"Sent to {', '.join(a for a in delivery.to if a not in refused)}"
+        if refused:
+            delivery.message += f" (refused: {', '.join(refused)})"
+        print(f"✔ {delivery.message}")
         return True
     except Exception as e:
-        print(f"❌ Failed to send email: {e}")
+        # The session may be half-way through a transaction: start the next one afresh
+        session.close()
+        delivery.status, delivery.message = "error", f"Failed to send email: {e}"
+        print(f"❌ {delivery.message}")
         return False
+    finally:
+        delivery.finished = time.time()
+
+
+def send_to_kindle(file_path: Path, override_email: str = None):
+    """
+    Sends file_path now, on a connection of its own (CLI and scripts; the web app queues).
+    """
+    settings = _settings()
+    to = recipients(override_email)
+    if not all([settings["server"], settings["port"], settings["sender"], to]):
+        print("⚠ Email configuration missing (check .env or provide email). Skipping Send to Kindle.")
+        return False
+
+    session = SmtpSession(settings)
+    try:
+        return deliver(Delivery(file_path, to), session)
+    finally:
+        session.close()
 
 if __name__ == "__main__":
     # Test run
     import sys
     if len(sys.argv) > 1:
-        send_to_kindle(Path(sys.argv[1]))
+        send_to_kindle(Path(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else None)
     else:
-        print("Usage: python email_service.py <path_to_file>")
+        print("Usage: python email_service.py <path_to_file> [kindle@kindle.com,...]")
@@ -0,0 +1,266 @@
+import hashlib
+import re
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from html import escape
+from pathlib import PurePosixPath
+
+from lxml import etree, html
+
+import metrics
+
+# Writes the EPUB straight into the zip as the build goes: every chapter and image is
+# stored the moment it is ready and only a small record of it is kept, so memory stays
+# flat however many articles an edition has. The package files (content.opf, toc.ncx,
+# nav.xhtml) are written last from those records.
+EPUB_ROOT = "EPUB/"
+
+CONTAINER_XML = """<?xml version='1.0' encoding='utf-8'?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+  <rootfiles>
+    <rootfile media-type="application/oebps-package+xml" full-path="EPUB/content.opf"/>
+  </rootfiles>
+</container>
+"""
+
+DOCUMENT = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+  <head>
+    <title>{title}</title>
+{links}  </head>
+  <body>{body}</body>
+</html>
+"""
+
+NCX_NS = {"ncx": "http://www.daisy.org/z3986/2005/ncx/"}
+IMAGE_SRC = re.compile(rb'<img[^>]+src="(images/[^"]+)"')
+
+MEDIA_TYPES = {
+    ".xhtml": "application/xhtml+xml",
+    ".jpg": "image/jpeg",
+    ".css": "text/css",
+    ".ncx": "application/x-dtbncx+xml",
+}
+
+
+@dataclass
+class Chapter:
+    """
+    A chapter already written to the archive: just what the TOC and manifest need.
+    """
+    uid: str
+    title: str
+    file_name: str
+    content_hash: str
+
+
+@dataclass
+class Link:
+    """
+    A further TOC entry pointing at a chapter that is already in the book.
+    """
+    href: str
+    title: str
+    uid: str
+
+
+def to_xhtml(fragment):
+    """
+    Normalises an HTML fragment (cleaned article, HN comments, ...) to well-formed XHTML.
+    """
+    if not fragment or not fragment.strip():
+        return ""
+    wrapper = html.fragment_fromstring(fragment, create_parent="div")
+    parts = [escape(wrapper.text, quote=False)] if wrapper.text else []
+    parts.extend(etree.tostring(child, method="xml", encoding="unicode") for child in wrapper)
+    return "".join(parts)
+
+
+class StreamingEpub:
+    """
+    EPUB 3 archive written incrementally to path. Call finalize() once every chapter has been
+    added, or abort() to drop a half-written file.
+    """
+
+    def __init__(self, path, identifier, title, language="en", author=None, stylesheet=None):
+        self.path = path
+        self.identifier = identifier
+        self.title = title
+        self.language = language
+        self.author = author
+        self.stylesheet = stylesheet
+        self.items = {}  # uid -> (href, media type), in write order
+        self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        # mimetype must be the first entry and stored uncompressed
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", CONTAINER_XML)
+
+    def _write(self, uid, file_name, data, compress=True):
+        with metrics.stage("epub_write"):
+            self.zip.writestr(EPUB_ROOT + file_name, data,
+                              compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        self.items[uid] = (file_name, MEDIA_TYPES[PurePosixPath(file_name).suffix])
+
+    def has_item(self, uid):
+        return uid in self.items
+
+    def add_style(self, file_name, css):
+        self._write("style", file_name, css)
+        self.stylesheet = file_name
+
+    def _document(self, title, body):
+        links = ""
+        if self.stylesheet:
+            links = f'    <link href="{escape(self.stylesheet)}" rel="stylesheet" type="text/css"/>\n'
+        return DOCUMENT.format(lang=self.language, title=escape(title, quote=False), links=links, body=body)
+
+    def add_chapter(self, title, file_name, body):
+        """
+        Writes a chapter from an HTML body fragment and returns its Chapter record.
+        """
+        return self.add_document(title, file_name, self._document(title, to_xhtml(body)).encode("utf-8"))
+
+    def add_document(self, title, file_name, document):
+        """
+        Writes a complete XHTML document as-is (e.g. a chapter copied from an earlier edition).
+        """
+        uid = PurePosixPath(file_name).stem
+        self._write(uid, file_name, document)
+        return Chapter(uid, title, file_name, hashlib.sha256(document).hexdigest())
+
+    def copy_chapter(self, archive, title, file_name, link_uid):
+        """
+        Copies a chapter and its images out of another edition's archive. Returns its Chapter,
+        or a Link (with link_uid) when the book already has it from another section.
+        """
+        uid = PurePosixPath(file_name).stem
+        if uid in self.items:
+            return Link(file_name, title, link_uid)
+        document = archive.read(EPUB_ROOT + file_name)
+        for src in IMAGE_SRC.findall(document):
+            image = src.decode("utf-8")
+            if EPUB_ROOT + image in archive.NameToInfo:
+                self.add_image(f"img-{PurePosixPath(image).stem}", image, archive.read(EPUB_ROOT + image))
+        return self.add_document(title, file_name, document)
+
+    def add_image(self, uid, file_name, data):
+        # JPEGs don't compress any further
+        if uid not in self.items:
+            self._write(uid, file_name, data, compress=False)
+        return file_name
+
+    def finalize(self, toc, spine):
+        """
+        Writes nav.xhtml, toc.ncx and content.opf and closes the archive.
+        toc is [(section name, [Chapter | Link, ...]), ...] or bare Chapters for top-level
+        entries; spine is the reading order of Chapters. The contents page goes after the
+        first entry of both (the cover).
+        """
+        nav = self.add_document("Contents", "nav.xhtml", self._nav_document(toc).encode("utf-8"))
+        self.zip.writestr(EPUB_ROOT + "toc.ncx", self._ncx(toc[:1] + [nav] + toc[1:]))
+        self.items["ncx"] = ("toc.ncx", MEDIA_TYPES[".ncx"])
+        self.zip.writestr(EPUB_ROOT + "content.opf", self._opf(spine[:1] + [nav] + spine[1:], nav))
+        self.zip.close()
+
+    def abort(self):
+        self.zip.close()
+        self.path.unlink(missing_ok=True)
+
+    # -- package documents --
+
+    def _nav_document(self, toc):
+        parts = ['<nav epub:type="toc" id="toc"><h1>Table of Contents</h1><ol>']
+        for entry in toc:
+            if isinstance(entry, tuple):
+                section_name, chapters = entry
+                parts.append(f"<li><span>{escape(section_name, quote=False)}</span><ol>")
+                for chap in chapters:
+                    parts.append(f'<li><a href="{escape(_href(chap))}">{escape(chap.title, quote=False)}</a></li>')
+                parts.append("</ol></li>")
+            else:
+                parts.append(f'<li><a href="{escape(_href(entry))}">{escape(entry.title, quote=False)}</a></li>')
+        parts.append("</ol></nav>")
+        return self._document("Contents", "".join(parts))
+
+    def _ncx(self, toc):
+        play_order = 0
+
+        def nav_point(uid, title, href, children=()):
+            nonlocal play_order
+            play_order += 1
+            # A section is numbered before its children, as readers expect
+            point = (f'<navPoint id="{escape(uid)}" playOrder="{play_order}"><navLabel><text>'
+                     f'{escape(title, quote=False)}</text></navLabel><content src="{escape(href)}"/>')
+            inner = "".join(nav_point(chap.uid, chap.title, _href(chap)) for chap in children)
+            return f"{point}{inner}</navPoint>"
+
+        points = []
+        for index, entry in enumerate(toc):
+            if isinstance(entry, tuple):
+                section_name, chapters = entry
+                if chapters:
+                    points.append(nav_point(f"section-{index}", section_name, _href(chapters[0]), chapters))
+            else:
+                points.append(nav_point(entry.uid, entry.title, _href(entry)))
+
+        return f"""<?xml version='1.0' encoding='utf-8'?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta name="dtb:uid" content="{escape(self.identifier)}"/>
+    <meta name="dtb:depth" content="2"/>
+  </head>
+  <docTitle><text>{escape(self.title, quote=False)}</text></docTitle>
+  <navMap>{"".join(points)}</navMap>
+</ncx>
+"""
+
+    def _opf(self, spine, nav):
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        creator = f"<dc:creator>{escape(self.author, quote=False)}</dc:creator>" if self.author else ""
+        manifest = []
+        for uid, (href, media_type) in self.items.items():
+            properties = ' properties="nav"' if uid == nav.uid else ""
+            manifest.append(f'<item id="{escape(uid)}" href="{escape(href)}" media-type="{media_type}"{properties}/>')
+        itemrefs = "".join(f'<itemref idref="{escape(chap.uid)}"/>' for chap in spine)
+
+        return f"""<?xml version='1.0' encoding='utf-8'?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">{escape(self.identifier, quote=False)}</dc:identifier>
+    <dc:title>{escape(self.title, quote=False)}</dc:title>
+    <dc:language>{escape(self.language, quote=False)}</dc:language>
+    {creator}
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>{"".join(manifest)}</manifest>
+  <spine toc="ncx">{itemrefs}</spine>
+</package>
+"""
+
+
+def _href(entry):
+    return entry.href if isinstance(entry, Link) else entry.file_name
+
+
+def read_toc(archive):
+    """
+    [(section name, [(title, file name), ...]), ...] in edition order, from an edition
+    archive's toc.ncx (top-level entries such as the cover are left out).
+    """
+    ncx = etree.fromstring(archive.read(EPUB_ROOT + "toc.ncx"))
+    sections = []
+    for point in ncx.iterfind("ncx:navMap/ncx:navPoint", NCX_NS):
+        children = point.findall("ncx:navPoint", NCX_NS)
+        if children:
+            sections.append((_label(point), [(_label(child), _src(child)) for child in children]))
+    return sections
+
+
+def _label(point):
+    return point.findtext("ncx:navLabel/ncx:text", "", NCX_NS)
+
+
+def _src(point):
+    return point.find("ncx:content", NCX_NS).get("src").split("#")[0]
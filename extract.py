@@ -0,0 +1,136 @@
+import threading
+import time
+from datetime import datetime
+from html import escape
+
+from readability import Document
+
+import article_cache
+import metrics
+import site_extractors
+from cleaner import clean_html
+from edition_manifest import entry_fingerprint
+from fetch_pool import cpu_call, fetch
+from images import fetch_image
+
+# Which extractor produced each article this build, and the time spent in each (wall-clock,
+# pool hand-off included): the fast-path hit rate and the time it saves over readability
+STATS = {"fast": 0, "readability": 0, "fast_seconds": 0.0, "readability_seconds": 0.0}
+_lock = threading.Lock()
+
+# Stage names for the metrics report, by extractor
+STAGES = {"fast": "extract_fast", "readability": "readability"}
+
+
+def extract_article(job):
+    """
+    Raw article page bytes in, cleaned article XHTML and page metadata out.
+    Pure function so it can run in the process pool: job is (source, raw_html).
+    Tries the site's fast path first (see site_extractors) and falls back to readability.
+    Returns {"body", "headline", "date", "image", "extractor"}.
+    """
+    source, raw_html = job
+    fast = site_extractors.extract(source, raw_html)
+    if fast is not None:
+        return {**fast, "extractor": "fast"}
+    return {"body": clean_html(Document(raw_html).summary(), source), "headline": "", "date": "", "image": "",
+            "extractor": "readability"}
+
+
+def extract(source, raw_html, timings=None):
+    """
+    Runs extract_article in the shared process pool (in-process when CPU_WORKERS <= 1) and
+    records which extractor was used. Pass a dict as timings to collect the seconds spent
+    (see metrics.stage).
+    """
+    started = time.perf_counter()
+    result = cpu_call(extract_article, (source, raw_html))
+    elapsed = time.perf_counter() - started
+
+    path = result["extractor"]
+    metrics.observe(STAGES[path], elapsed)
+    if timings is not None:
+        timings[STAGES[path]] = round(elapsed, 4)
+    if metrics.live():
+        with _lock:
+            STATS[path] += 1
+            STATS[f"{path}_seconds"] += elapsed
+    return result
+
+
+def page_meta(result):
+    """
+    The page metadata worth caching with the body: whatever the extractor found.
+    """
+    return {key: result[key] for key in ("headline", "date", "image") if result.get(key)}
+
+
+def download_article(source, entry, pick_image_url):
+    """
+    Downloads and cleans an article page (Guardian, BBC) and fetches its lead image: the one
+    pick_image_url(entry) finds in the feed, else the page's own. Runs in the fetch pool;
+    extraction is handed to the process pool. Skips the page entirely when it's already cached
+    for this revision of the feed entry (an updated story is fetched again).
+    Returns (body, image, image error, page metadata).
+    """
+    timings = {}
+    revision = entry_fingerprint(entry)
+    found = article_cache.lookup(entry.link, revision=revision)
+    cached = found is not None
+    extractor = None
+    if found is None:
+        with metrics.stage("article_download", timings):
+            raw = fetch(entry.link, timeout=15).content
+        result = extract(source, raw, timings)
+        body, meta, extractor = result["body"], page_meta(result), result["extractor"]
+        article_cache.put(entry.link, body, meta, revision)
+    else:
+        body, meta = found
+
+    image, img_error = None, None
+    img_url = pick_image_url(entry) or meta.get("image")
+    if img_url:
+        try:
+            with metrics.stage("article_image", timings):
+                image = fetch_image(img_url)
+        except Exception as e:
+            img_error = e
+
+    metrics.article(source, entry.link, cached=cached, extractor=extractor, body_bytes=len(body),
+                    image_bytes=len(image[1]) if image else 0, **timings)
+    return body, image, img_error, meta
+
+
+def summary():
+    parts = []
+    for path, label in (("fast", "fast path"), ("readability", "readability")):
+        if STATS[path]:
+            parts.append(f"{STATS[path]} {label} ({STATS[f'{path}_seconds'] / STATS[path] * 1000:.0f} ms avg)")
+    return f"Extraction: {', '.join(parts) or 'nothing extracted'}"
+
+
+def pub_date(entry, meta=None):
+    """
+    The chapter's date line: from the feed entry, else from the page (meta["date"], ISO 8601).
+    """
+    if getattr(entry, "published_parsed", None):
+        return datetime(*entry.published_parsed[:6]).strftime("%d %b %Y %H:%M")
+    if meta and meta.get("date"):
+        try:
+            return datetime.fromisoformat(meta["date"]).strftime("%d %b %Y %H:%M")
+        except ValueError:
+            pass
+    return ""
+
+
+def chapter_html(title, pub_date="", img_src=None, body=""):
+    """
+    Wraps a cleaned article body with its headline, date and lead image.
+    """
+    parts = [f"<h1>{escape(title, quote=False)}</h1>"]
+    if pub_date:
+        parts.append(f"<p>{escape(pub_date, quote=False)}</p>")
+    if img_src:
+        parts.append(f'<img src="{escape(img_src)}"/>')
+    parts.append(body)
+    return "".join(parts)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import pickle
+import threading
+
+import feedparser
+
+import metrics
+from cache_paths import CACHE_DIR, write_atomic
+from fetch_pool import HEADERS, fetch
+
+FEED_CACHE_DIR = CACHE_DIR / "feeds"
+
+STATS = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _paths(url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return FEED_CACHE_DIR / f"{key}.json", FEED_CACHE_DIR / f"{key}.pickle"
+
+
+def count(hit):
+    if not metrics.live():
+        return
+    with _stats_lock:
+        STATS["hits" if hit else "misses"] += 1
+
+
+def validators(url):
+    """
+    Returns the stored (etag, last_modified) for a feed url, or (None, None).
+    Validators are only offered when the parsed entries are still on disk to reuse.
+    """
+    meta_path, entries_path = _paths(url)
+    if not entries_path.exists():
+        return None, None
+    try:
+        meta = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return None, None
+    return meta.get("etag"), meta.get("last_modified")
+
+
+def conditional_headers(url):
+    """
+    Request headers for a conditional GET of url.
+    """
+    etag, last_modified = validators(url)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def load(url):
+    """
+    Returns the parsed entries stored for url, or None.
+    """
+    _, entries_path = _paths(url)
+    try:
+        return pickle.loads(entries_path.read_bytes())
+    except (OSError, pickle.PickleError, EOFError):
+        return None
+
+
+def store(url, etag, last_modified, entries):
+    """
+    Saves the validators and parsed entries for url. Feeds without validators are not cached.
+    """
+    if not etag and not last_modified:
+        return
+    meta_path, entries_path = _paths(url)
+    try:
+        write_atomic(entries_path, pickle.dumps(entries))
+        write_atomic(meta_path, json.dumps({"url": url, "etag": etag, "last_modified": last_modified}).encode())
+    except (OSError, pickle.PickleError) as e:
+        print(f"   feed cache write failed for {url}: {e}")
+
+
+def parse_cached(url):
+    """
+    Conditional fetch + parse for callers outside the discovery phase.
+    Returns the entries, reusing the cached ones when the server answers 304.
+    """
+    r = fetch(url, headers={**HEADERS, **conditional_headers(url)})
+    if r.status_code == 304:
+        entries = load(url)
+        if entries is not None:
+            count(hit=True)
+            return entries
+        r = fetch(url)
+
+    count(hit=False)
+    entries = feedparser.parse(r.content).entries
+    store(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), entries)
+    return entries
+
+
+def summary():
+    return f"Feed cache: {STATS['hits']} hits, {STATS['misses']} misses"
@@ -0,0 +1,93 @@
+import json
+import time
+
+import feedparser
+
+import feed_cache
+import metrics
+from fetch_pool import HEADERS, fetch, map_ordered, cpu_map
+
+
+def parse_feed(job):
+    """
+    Parses a downloaded feed body. Runs in the process pool, so it must stay a plain function.
+    """
+    kind, body = job
+    started = time.monotonic()
+    if kind == "json":
+        entries = json.loads(body)
+    else:
+        entries = feedparser.parse(body).entries
+    return entries, time.monotonic() - started
+
+
+def discover_feeds(feeds):
+    """
+    Resolves every feed at once before any article work starts.
+    feeds is a list of (name, url, kind) where kind is "rss" or "json".
+    RSS feeds are requested conditionally (ETag/Last-Modified) and reuse the cached entries on 304.
+    Returns {name: {"entries", "bytes", "fetch_seconds", "parse_seconds", "cached", "error"}}.
+    """
+    print(f"Discovering {len(feeds)} feeds...")
+
+    def download(feed):
+        _, url, kind = feed
+        started = time.monotonic()
+        if kind != "rss":
+            return fetch(url, timeout=15).content, time.monotonic() - started, None, None, None
+
+        r = fetch(url, timeout=15, headers={**HEADERS, **feed_cache.conditional_headers(url)})
+        elapsed = time.monotonic() - started
+
+        # 304: nothing changed since the last edition, reuse the parsed entries
+        if r.status_code == 304:
+            entries = feed_cache.load(url)
+            if entries is not None:
+                feed_cache.count(hit=True)
+                return None, elapsed, entries, None, None
+            r = fetch(url, timeout=15)
+
+        feed_cache.count(hit=False)
+        return r.content, elapsed, None, r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+    downloads = map_ordered(download, feeds)
+
+    # Parse everything that was (re)downloaded in the worker pool
+    parse_jobs = [
+        (kind, result[0]) for (_, _, kind), (result, error) in zip(feeds, downloads)
+        if not error and result[0] is not None
+    ]
+    started = time.monotonic()
+    parsed = iter(cpu_map(parse_feed, parse_jobs))
+    parse_wall = time.monotonic() - started
+
+    results = {}
+    for (name, url, kind), (result, error) in zip(feeds, downloads):
+        info = {"entries": [], "bytes": 0, "fetch_seconds": 0.0, "parse_seconds": 0.0, "cached": False, "error": None}
+        if error:
+            info["error"] = error
+            print(f" ⚠ {name}: fetch failed: {error}")
+        elif result[0] is None:
+            _, info["fetch_seconds"], info["entries"], _, _ = result
+            info["cached"] = True
+            print(f" ✔ {name}: {len(info['entries'])} entries, not modified (cached), "
+                  f"fetch {info['fetch_seconds']:.2f}s")
+        else:
+            body, info["fetch_seconds"], _, etag, last_modified = result
+            info["bytes"] = len(body)
+            parse_result, parse_error = next(parsed)
+            if parse_error:
+                info["error"] = parse_error
+                print(f" ⚠ {name}: parse failed: {parse_error}")
+            else:
+                info["entries"], info["parse_seconds"] = parse_result
+                metrics.observe("feed_parse", info["parse_seconds"])
+                if kind == "rss":
+                    feed_cache.store(url, etag, last_modified, info["entries"])
+                print(f" ✔ {name}: {len(info['entries'])} entries, {info['bytes'] // 1024} KB, "
+                      f"fetch {info['fetch_seconds']:.2f}s, parse {info['parse_seconds']:.2f}s")
+        metrics.observe("feed_fetch", info["fetch_seconds"])
+        results[name] = info
+
+    print(f"Feeds parsed in {parse_wall:.2f}s. {feed_cache.summary()}")
+    return results
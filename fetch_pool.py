@@ -0,0 +1,231 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import deadline
+import http_client
+import metrics
+from deadline import DeadlineExceeded
+
+# Worker count for the download stage and the max concurrent requests to any one host.
+# Override with FETCH_WORKERS / FETCH_PER_HOST in .env.
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST", "4"))
+
+# Process pool size for CPU-bound work (feed parsing etc.). 0 or 1 runs it in-process.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# Hosts that tolerate more (or need fewer) concurrent requests than PER_HOST_LIMIT
+HOST_LIMITS = {}
+
+_host_slots = {}
+_host_lock = threading.Lock()
+
+_cpu_pool = None
+_cpu_lock = threading.Lock()
+
+
+@contextmanager
+def host_slot(url):
+    """
+    Holds one of the connection slots for the url's host (HOST_LIMITS, else PER_HOST_LIMIT).
+    """
+    host = urlsplit(url).netloc
+    with _host_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            limit = HOST_LIMITS.get(host, PER_HOST_LIMIT)
+            slot = _host_slots[host] = threading.BoundedSemaphore(max(1, limit))
+    with slot:
+        yield
+
+
+def set_host_limit(host, limit):
+    """
+    Overrides the concurrent request limit for one host. Call before the first request to it.
+    """
+    with _host_lock:
+        HOST_LIMITS[host] = limit
+        _host_slots.pop(host, None)
+
+
+def fetch(url, timeout=15, headers=None):
+    """
+    GETs a url through the shared HTTP client within the per-host limit and raises on
+    HTTP errors (after the client's retries). The timeout is cut to the time left before the
+    current deadline; DeadlineExceeded is raised once it has passed.
+    """
+    timeout = deadline.clip(timeout)
+    with host_slot(url):
+        r = http_client.get(url, headers=headers or HEADERS, timeout=timeout)
+    r.raise_for_status()
+    return r
+
+
+def _under(current, fn):
+    # Pool threads run fn under the caller's deadline, so their fetches are clipped too, and
+    # record into the caller's build report, so work outliving its build can't reach the next
+    report = metrics.current()
+
+    def run(item):
+        with deadline.using(current), metrics.using(report):
+            return fn(item)
+    return run
+
+
+def map_ordered(fn, items, workers=None):
+    """
+    Runs fn over items in a thread pool.
+    Returns a list of (result, error) pairs in the same order as items, so callers can
+    assemble output deterministically regardless of which download finished first.
+    Items not finished by the current deadline get a DeadlineExceeded error.
+    """
+    items = list(items)
+    if not items:
+        return []
+    current = deadline.current()
+    if current is not None and current.expired:
+        return [(None, DeadlineExceeded(current.reason()))] * len(items)
+
+    def call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, e
+
+    workers = max(1, min(workers or FETCH_WORKERS, len(items)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(_under(current, call), item) for item in items]
+        done, _ = wait(futures, timeout=current.remaining() if current is not None else None)
+        return [f.result() if f in done else (None, DeadlineExceeded(current.reason())) for f in futures]
+    finally:
+        # Past the deadline: queued items are dropped and running ones are left to time out
+        pool.shutdown(wait=current is None, cancel_futures=True)
+
+
+def map_completed(fn, items, workers=None):
+    """
+    Runs fn over items in a thread pool and yields (item, result, error) as each one finishes,
+    so callers can write results out straight away instead of holding all of them.
+    Items not finished by the current deadline are yielded last with a DeadlineExceeded error.
+    """
+    items = list(items)
+    if not items:
+        return
+    current = deadline.current()
+    if current is not None and current.expired:
+        for item in items:
+            yield item, None, DeadlineExceeded(current.reason())
+        return
+
+    workers = max(1, min(workers or FETCH_WORKERS, len(items)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(_under(current, fn), item): item for item in items}
+        try:
+            for future in as_completed(futures, timeout=current.remaining() if current is not None else None):
+                # Drop our reference so the result is freed once the caller is done with it
+                item = futures.pop(future)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                yield item, result, error
+        except FuturesTimeout:
+            for future, item in list(futures.items()):
+                if future.cancel() or not future.done():
+                    yield item, None, DeadlineExceeded(current.reason())
+                    continue
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
+    finally:
+        pool.shutdown(wait=current is None, cancel_futures=True)
+
+
+def _get_cpu_pool():
+    global _cpu_pool
+    with _cpu_lock:
+        if _cpu_pool is None:
+            # forkserver children start clean instead of forking a threaded web server mid-request.
+            # They still import the main script (as __mp_main__), so its start-up belongs under
+            # if __name__ == "__main__" (see app.start)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver") if "forkserver" in methods else None
+            _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=context)
+        return _cpu_pool
+
+
+def _reset_cpu_pool():
+    global _cpu_pool
+    with _cpu_lock:
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+
+
+def cpu_map(fn, items):
+    """
+    Like map_ordered, but runs fn in a shared process pool so CPU-bound work uses all cores.
+    fn and items must be picklable. Falls back to running in-process when CPU_WORKERS <= 1
+    or the pool cannot be used.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, e
+
+    if CPU_WORKERS <= 1 or len(items) == 1:
+        return [call(item) for item in items]
+
+    try:
+        futures = [_get_cpu_pool().submit(fn, item) for item in items]
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        print(f"⚠ Process pool unavailable ({e}), running in-process")
+        _reset_cpu_pool()
+        return [call(item) for item in items]
+
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append((future.result(), None))
+        except BrokenProcessPool:
+            _reset_cpu_pool()
+            results.append(call(item))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def cpu_call(fn, arg):
+    """
+    Runs a single fn(arg) in the shared process pool and waits for it.
+    Lets fetch-pool threads hand off CPU-bound steps without serialising on the GIL.
+    """
+    if CPU_WORKERS <= 1:
+        return fn(arg)
+    try:
+        future = _get_cpu_pool().submit(fn, arg)
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        print(f"⚠ Process pool unavailable ({e}), running in-process")
+        _reset_cpu_pool()
+        return fn(arg)
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        _reset_cpu_pool()
+        return fn(arg)
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+from cache_paths import CACHE_DIR
+
+# Output formats other than the EPUB itself are converted from it by ebook-converter,
+# in a small pool of their own so a build (or a download) never waits on one it doesn't need.
+# Results are cached by the EPUB's content hash: rebuilding an identical edition, or asking
+# for the same format twice, never runs the converter again.
+CONVERTER = os.getenv("EBOOK_CONVERTER", "ebook-converter")
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", "2"))
+CONVERT_TIMEOUT = int(os.getenv("CONVERT_TIMEOUT", "600"))
+CONVERTED_DIR = CACHE_DIR / "converted"
+
+# Everything an edition can be delivered as. Only epub is built by default; the rest are
+# requested with OUTPUT_FORMATS=epub,mobi (or EditionConfig.formats) or built on first download.
+FORMATS = ("epub", "mobi", "azw3")
+
+
+def parse(names):
+    """
+    Format names (a list, or a comma-separated string) as a tuple of known formats:
+    lower-cased and stripped, with unknown names dropped with a warning.
+    """
+    if isinstance(names, str):
+        names = names.split(",")
+    chosen = []
+    for name in names:
+        fmt = str(name).strip().lower()
+        if not fmt or fmt in chosen:
+            continue
+        if fmt not in FORMATS:
+            print(f"⚠ Ignoring unknown output format {name!r} (known: {', '.join(FORMATS)})")
+            continue
+        chosen.append(fmt)
+    return tuple(chosen)
+
+
+DEFAULT_FORMATS = parse(os.getenv("OUTPUT_FORMATS", "epub"))
+
+_pool = ThreadPoolExecutor(max_workers=max(1, CONVERT_WORKERS), thread_name_prefix="convert")
+_pending = {}
+_lock = threading.RLock()
+
+
+def epub_hash(epub_path):
+    h = hashlib.sha256()
+    with open(epub_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def target_path(epub_path, fmt):
+    return Path(epub_path).with_suffix(f".{fmt}")
+
+
+def _convert(epub_path, fmt, digest):
+    """
+    Produces epub_path's sibling .fmt file, from the cache when this exact EPUB was converted before.
+    """
+    target = target_path(epub_path, fmt)
+    cached = CONVERTED_DIR / f"{digest}.{fmt}"
+    if cached.exists():
+        print(f"✔ {fmt.upper()} reused from conversion cache")
+    else:
+        CONVERTED_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = CONVERTED_DIR / f"{digest}.{os.getpid()}.{threading.get_ident()}.{fmt}"
+        try:
+            with metrics.stage(f"convert_{fmt}"):
+                subprocess.run([CONVERTER, str(epub_path), str(tmp)], check=True, timeout=CONVERT_TIMEOUT)
+            tmp.replace(cached)
+        finally:
+            tmp.unlink(missing_ok=True)
+        print(f"✔ {fmt.upper()} created")
+
+    # Copy rather than link: the cache may be evicted or live on another filesystem
+    tmp_target = target.with_name(f"{target.name}.tmp")
+    shutil.copyfile(cached, tmp_target)
+    tmp_target.replace(target)
+    return target
+
+
+def submit(epub_path, fmt):
+    """
+    Queues a conversion of epub_path to fmt and returns a Future for the output path.
+    Requests for a conversion that is already running share its Future.
+    """
+    if fmt not in FORMATS or fmt == "epub":
+        raise ValueError(f"Unsupported output format: {fmt}")
+    digest = epub_hash(epub_path)
+    key = (digest, fmt)
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pending[key] = _pool.submit(_convert, epub_path, fmt, digest)
+            future.add_done_callback(lambda _: _forget(key))
+    return future
+
+
+def _forget(key):
+    with _lock:
+        _pending.pop(key, None)
+
+
+def ensure(epub_path, fmt):
+    """
+    Returns the path of epub_path in fmt, converting now if it hasn't been built yet.
+    Raises if the conversion fails.
+    """
+    target = target_path(epub_path, fmt)
+    if fmt == "epub" or (target.exists() and target.stat().st_mtime >= Path(epub_path).stat().st_mtime):
+        return target
+    return submit(epub_path, fmt).result()
+
+
+def evict(keep=20):
+    """
+    Keeps the most recent `keep` converted files in the cache.
+    """
+    if not CONVERTED_DIR.exists():
+        return
+    files = sorted(CONVERTED_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in files[keep:]:
+        path.unlink(missing_ok=True)
@@ -1,16 +1,39 @@
 #!/usr/bin/env python3
-import feedparser
-import requests
-from readability import Document
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from pathlib import Path
-from PIL import Image
-import io
-import subprocess
+from dataclasses import dataclass, field
+from typing import Callable
 from datetime import datetime
+import os
 import sys
 
+from fetch_pool import map_completed, FETCH_WORKERS
+import http_client
+import feed_cache
+from feed_discovery import discover_feeds
+import article_cache
+from article_cache import canonical_url
+import images
+from images import add_to_book
+import extract
+from extract import chapter_html, pub_date
+from bbc_fetcher import BBC_FEED_URL, fetch_bbc_news
+from hn_fetcher import HN_TOPSTORIES_URL, fetch_hn_threads
+import hn_cache
+import formats
+import metrics
+import edition_index
+import build_lock
+import deadline
+from epub_writer import StreamingEpub, Link
+from edition_manifest import Manifest, PreviousEdition, entry_fingerprint, manifest_path
+
+# Paid once per process; a long-lived worker (the web app) reuses warm imports, pools and caches
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 # -----------------------------
 FEEDS = {
     "UK News": "https://www.theguardian.com/uk-news/rss",
@@ -25,267 +48,485 @@ FEEDS = {
     "Games": "https://www.theguardian.com/games/rss",
 }
 
-ARTICLES_PER_FEED = 5
-ENABLED_FEEDS = None
-
-if len(sys.argv) > 1:
-    try:
-        ARTICLES_PER_FEED = int(sys.argv[1])
-    except ValueError:
-        pass  # Keep default if invalid
-
-if len(sys.argv) > 2:
-    # Second argument is comma-separated list of enabled feeds
-    raw_feeds = sys.argv[2]
-    if raw_feeds.strip():
-        ENABLED_FEEDS = [f.strip() for f in raw_feeds.split(",") if f.strip()]
-
 OUTPUT = Path("output")
-OUTPUT.mkdir(exist_ok=True)
-
-# Cleanup old files
-print("Cleaning up old files...")
-for old_file in OUTPUT.glob("*.epub"):
-    old_file.unlink()
-for old_file in OUTPUT.glob("*.mobi"):
-    old_file.unlink()
-
-today_str = datetime.now().strftime("%Y-%m-%d")
-today_human = datetime.now().strftime("%d %B %Y")
+# Past editions kept in OUTPUT (with their converted formats) and downloadable by date
+EDITIONS_KEEP = int(os.getenv("EDITIONS_KEEP", "7"))
+# Seconds the Guardian articles may take within the build's budget (0 = no separate limit)
+GUARDIAN_BUDGET = float(os.getenv("GUARDIAN_BUDGET", "360"))
 
-EPUB_FILE = OUTPUT / f"guardian-{today_str}.epub"
-MOBI_FILE = OUTPUT / f"guardian-{today_str}.mobi"
+CSS = """
+body { font-family: serif; line-height:1.5; margin:1em; }
+h1 { font-size:1.4em; }
+h2 { font-size:1.2em; margin-top:1em; border-bottom: 1px solid #ccc; padding-bottom: 0.2em; }
+ul { margin-left: 1em; padding-left: 0; list-style-type: none; }
+li { margin-bottom: 0.5em; }
+a { text-decoration: none; color: #000; }
+a:hover { text-decoration: underline; }
+img { max-width: 100%; height: auto; display: block; margin: 1em 0; }
+nav ol { margin-left: 1em; padding-left: 0; list-style-type: none; }
+nav li { margin-bottom: 0.5em; }
+nav li > span { display: block; font-size:1.2em; font-weight: bold; margin-top:1em; border-bottom: 1px solid #ccc; padding-bottom: 0.2em; }
+"""
 
-HEADERS = {"User-Agent": "Mozilla/5.0"}
+_builds_done = 0
 
-# -----------------------------
-book = epub.EpubBook()
-book.set_identifier(f"guardian-{today_str}")
-book.set_title(f"Guardian Daily - {today_human}")
-book.set_language("en")
-book.add_author(today_human)
-
-# Cover
-cover = epub.EpubHtml(
-    title="Cover",
-    file_name="cover.xhtml",
-    content=f"<h1>The Guardian Daily</h1><h3>{today_human}</h3><p>Generated edition</p>"
-)
-book.add_item(cover)
-
-# Store structure for TOC: [(SectionName, [EpubHtml_objs...]), ...]
-toc_structure = []
-all_chapters = []
-
-img_counter = 1
 
-# -----------------------------
-print("Fetching RSS feeds...")
+@dataclass
+class EditionConfig:
+    """
+    What to build. sections=None means every Guardian section plus BBC and Hacker News.
+    feeds maps Guardian section names to RSS urls (defaults to FEEDS). formats lists the
+    outputs to produce besides the EPUB (see formats.FORMATS); others are built on demand.
+    progress, if set, is called as progress(percent, message, **detail) while the build runs;
+    detail names the section and/or article just processed. budget is the build's time limit
+    in seconds (0 = none): work still outstanding then is dropped and the edition is built
+    from what finished.
+    """
+    articles_per_feed: int = 5
+    sections: list = None
+    output_dir: Path = OUTPUT
+    feeds: dict = field(default_factory=lambda: dict(FEEDS))
+    formats: tuple = formats.DEFAULT_FORMATS
+    progress: Callable = None
+    budget: float = deadline.BUILD_BUDGET
 
-for section_name, url in FEEDS.items():
-    # Filter if enabled feeds are specified
-    if ENABLED_FEEDS is not None and section_name not in ENABLED_FEEDS:
-        continue
+    def is_enabled(self, section_name):
+        return self.sections is None or section_name in self.sections
 
-    print(f"\n== {section_name}")
-    feed = feedparser.parse(url)
-    
-    if not feed.entries:
-        print(" ⚠ No entries found")
-        continue
 
-    section_chapters = []
+def _progress(config, percent, message, **detail):
+    if config.progress is not None:
+        config.progress(percent, message, **detail)
 
-    for idx, entry in enumerate(feed.entries[:ARTICLES_PER_FEED], start=1):
-        print(" •", entry.title)
-        try:
-            # Fetch article text
-            r = requests.get(entry.link, headers=HEADERS, timeout=15)
-            r.raise_for_status()
-
-            soup = BeautifulSoup(Document(r.text).summary(), "html.parser")
-            for svg in soup.find_all("svg"):
-                svg.decompose()
-
-            # Date
-            pub_date = ""
-            if hasattr(entry, "published_parsed"):
-                d = datetime(*entry.published_parsed[:6])
-                pub_date = d.strftime("%d %b %Y %H:%M")
-
-            # Image
-            if hasattr(entry, "media_content"):
-                media = entry.media_content[-1]
-                if len(entry.media_content) > 2:
-                    media = entry.media_content[2]
-                img_url = media.get("url")
-            else:
-                img_url = None
-
-            if img_url:
-                try:
-                    img_res = requests.get(img_url, headers=HEADERS, timeout=10)
-                    im = Image.open(io.BytesIO(img_res.content))
-                    im = im.convert("RGB")
-                    buf = io.BytesIO()
-                    im.save(buf, "JPEG", quality=60)
-                    img_data = buf.getvalue()
-
-                    img_name = f"{section_name.lower().replace(' ', '')}-{idx}.jpg"
-                    img_item = epub.EpubItem(
-                        uid=img_name,
-                        file_name=f"images/{img_name}",
-                        media_type="image/jpeg",
-                        content=img_data
-                    )
-                    book.add_item(img_item)
-
-                    img_tag = soup.new_tag("img", src=f"images/{img_name}")
-                    soup.insert(0, img_tag)
-                except Exception as e:
-                    print("   image failed:", e)
-
-            # Build content
-            h1 = soup.new_tag("h1")
-            h1.string = entry.title
-            soup.insert(0, h1)
-
-            if pub_date:
-                p_date = soup.new_tag("p")
-                p_date.string = pub_date
-                soup.insert(1, p_date)
-
-            fname = f"{section_name.lower().replace(' ', '')}-{idx}.xhtml"
-            chap = epub.EpubHtml(
-                title=entry.title,
-                file_name=fname,
-                content=str(soup)
-            )
-            book.add_item(chap)
-            
-            section_chapters.append(chap)
-            all_chapters.append(chap)
 
-        except Exception as e:
-            print("   article error:", e)
+def _reset_counters():
+    # Cache/HTTP counters are per build, even when the process builds many editions
+    for stats in (feed_cache.STATS, article_cache.STATS, images.STATS, hn_cache.STATS, extract.STATS):
+        for key in stats:
+            stats[key] = 0
+    http_client.STATS.clear()
 
-    if section_chapters:
-        toc_structure.append((section_name, section_chapters))
 
 # -----------------------------
-# BBC INTEGRATION
+# FEED DISCOVERY
+# Resolve every enabled feed up front, concurrently, before any article work starts
 # -----------------------------
-if ENABLED_FEEDS is None or "BBC Top Stories" in ENABLED_FEEDS:
-    try:
-        from bbc_fetcher import fetch_bbc_news
-        bbc_items = fetch_bbc_news(ARTICLES_PER_FEED, book)
-        if bbc_items:
-            toc_structure.append(("BBC Top Stories", bbc_items))
-            all_chapters.extend(bbc_items)
-    except Exception as e:
-        print(f"⚠ Failed to fetch BBC: {e}")
+def discover(config):
+    """
+    Returns (discovered, sections, hn_top_ids) where sections is the unified work list for
+    the Guardian article stage: [(section, [(idx, entry), ...]), ...].
+    """
+    feed_jobs = [(name, url, "rss") for name, url in config.feeds.items() if config.is_enabled(name)]
+    if config.is_enabled("BBC Top Stories"):
+        feed_jobs.append(("BBC Top Stories", BBC_FEED_URL, "rss"))
+    # The HN topstories list is reused for a few minutes, so repeated manual runs skip it
+    hn_top_ids = None
+    if config.is_enabled("Hacker News (Comments)"):
+        hn_top_ids = hn_cache.get_list("topstories")
+        if hn_top_ids is None:
+            feed_jobs.append(("Hacker News (Comments)", HN_TOPSTORIES_URL, "json"))
+
+    discovered = discover_feeds(feed_jobs)
+
+    if "Hacker News (Comments)" in discovered:
+        hn_top_ids = discovered["Hacker News (Comments)"]["entries"]
+        if hn_top_ids:
+            hn_cache.put_list("topstories", hn_top_ids)
+
+    sections = []
+    for section_name in config.feeds:
+        if section_name not in discovered:
+            continue
+
+        entries = discovered[section_name]["entries"]
+        if not entries:
+            print(f" ⚠ {section_name}: No entries found")
+            continue
+
+        sections.append((section_name, list(enumerate(entries[:config.articles_per_feed], start=1))))
+
+    return discovered, sections, hn_top_ids
 
-# -----------------------------
-# HACKER NEWS INTEGRATION
-# -----------------------------
-if ENABLED_FEEDS is None or "Hacker News (Comments)" in ENABLED_FEEDS:
-    try:
-        from hn_fetcher import fetch_hn_threads
-        hn_items = fetch_hn_threads(ARTICLES_PER_FEED, book)
-        if hn_items:
-            toc_structure.append(("Hacker News", hn_items))
-            all_chapters.extend(hn_items)
-    except Exception as e:
-        print(f"⚠ Failed to fetch Hacker News: {e}")
 
 # -----------------------------
-# NAVIGATION (manual nav.xhtml)
-print("\nBuilding nav.xhtml...")
-
-nav_html = ['<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Contents</title></head><body>']
-nav_html.append("<h1>Table of Contents</h1>")
-
-for section_name, chapters in toc_structure:
-    nav_html.append(f"<h2>{section_name}</h2>")
-    nav_html.append("<ul>")
-    for chap in chapters:
-        nav_html.append(f'<li><a href="{chap.file_name}">{chap.title}</a></li>')
-    nav_html.append("</ul>")
-
-nav_html.append("</body></html>")
-
-nav_page = epub.EpubHtml(title="Contents", file_name="nav.xhtml", content="".join(nav_html))
-book.add_item(nav_page)
-
+# GUARDIAN ARTICLES
 # -----------------------------
-# Finalize EPUB
-# Construct hierarchical TOC for device menu
-device_toc = [cover, nav_page]
-for section_name, chapters in toc_structure:
-    device_toc.append(
-        (epub.Section(section_name), chapters)
-    )
-
-book.toc = device_toc
-book.spine = ["nav", cover, nav_page] + all_chapters
+def pick_image_url(entry):
+    if hasattr(entry, "media_content"):
+        media = entry.media_content[-1]
+        if len(entry.media_content) > 2:
+            media = entry.media_content[2]
+        return media.get("url")
+    return None
+
+
+def download_article(entry):
+    return extract.download_article("guardian", entry, pick_image_url)
+
+
+def fetch_guardian(sections, book, previous=None, manifest=None, progress=None):
+    """
+    Downloads every Guardian article in parallel and writes each chapter into the book as soon
+    as it arrives; the TOC is then assembled in the original section/article order, and file
+    names depend only on that order. Articles unchanged since the previous edition are copied
+    from its archive instead of being fetched. Downloads still running when GUARDIAN_BUDGET
+    (or the build's budget) runs out are dropped.
+    progress, if given, is called as progress(done, total, section_name, title) after each article.
+    Returns (toc_structure, chapters).
+    """
+    manifest = manifest if manifest is not None else Manifest()
+
+    # The same article often appears in several sections (e.g. UK News and Scotland): fetch it
+    # once, stored under the file name of its first appearance
+    jobs = {}
+    for section_name, entries in sections:
+        for idx, entry in entries:
+            jobs.setdefault(canonical_url(entry.link), (section_name, f"{section_name.lower().replace(' ', '')}-{idx}.xhtml", entry))
+
+    written = {}
+    if previous is not None:
+        unchanged = [url_key for url_key, (_, _, entry) in jobs.items() if previous.has(entry)]
+        print(f"Reusing {len(unchanged)} unchanged articles from the previous edition")
+        for url_key in unchanged:
+            section_name, fname, entry = jobs[url_key]
+            chapter = previous.reuse(entry)
+            if chapter is None:
+                # Unreadable in the old archive: downloaded below like any other article
+                continue
+            del jobs[url_key]
+            # Verbatim copy of last edition's chapter and its images
+            content, chapter_images = chapter
+            for digest, data in chapter_images:
+                add_to_book(book, digest, data)
+            chap = book.add_document(entry.title, fname, content)
+            manifest.add(section_name, chap, entry.link, entry_fingerprint(entry),
+                         [digest for digest, _ in chapter_images])
+            written[url_key] = chap
+
+    print(f"Downloading {len(jobs)} articles with up to {FETCH_WORKERS} workers...")
+    total = len(jobs)
+    with deadline.limit("Guardian", GUARDIAN_BUDGET):
+        for done, ((section_name, fname, entry), result, error) in enumerate(
+                map_completed(lambda job: download_article(job[2]), jobs.values()), start=1):
+            if progress is not None:
+                progress(done, total, section_name, entry.title)
+            try:
+                if error:
+                    raise error
+                body, image, img_error, meta = result
+
+                # Image
+                if img_error:
+                    print(f"   image failed for {entry.title}: {img_error}")
+
+                img_src = add_to_book(book, *image) if image else None
+
+                chap = book.add_chapter(entry.title, fname, chapter_html(entry.title, pub_date(entry, meta), img_src, body))
+                manifest.add(section_name, chap, entry.link, entry_fingerprint(entry),
+                             [image[0]] if image else [])
+                written[canonical_url(entry.link)] = chap
+
+            except Exception as e:
+                print(f"   article error for {entry.title}: {e}")
+                metrics.dropped("guardian", entry.title, str(e))
+
+    toc_structure = []
+    all_chapters = []
+    placed = set()
+
+    for section_name, entries in sections:
+        print(f"\n== {section_name}")
+        section_chapters = []
+
+        for idx, entry in entries:
+            print(" •", entry.title)
+            url_key = canonical_url(entry.link)
+            chap = written.get(url_key)
+            if chap is None:
+                print("   (failed)")
+                continue
+            if url_key in placed:
+                # Listed again under this section, but stored in the book only once
+                print("   (already included)")
+                link_uid = f"{section_name.lower().replace(' ', '')}-{idx}-link"
+                section_chapters.append(Link(chap.file_name, chap.title, uid=link_uid))
+                continue
+
+            placed.add(url_key)
+            section_chapters.append(chap)
+            all_chapters.append(chap)
 
-book.add_item(epub.EpubNcx())
-book.add_item(epub.EpubNav())
+        if section_chapters:
+            toc_structure.append((section_name, section_chapters))
 
-CSS = """
-body { font-family: serif; line-height:1.5; margin:1em; }
-h1 { font-size:1.4em; }
-h2 { font-size:1.2em; margin-top:1em; border-bottom: 1px solid #ccc; padding-bottom: 0.2em; }
-ul { margin-left: 1em; padding-left: 0; list-style-type: none; }
-li { margin-bottom: 0.5em; }
-a { text-decoration: none; color: #000; }
-a:hover { text-decoration: underline; }
-img { max-width: 100%; height: auto; display: block; margin: 1em 0; }
-"""
-style = epub.EpubItem(uid="style", file_name="style/main.css", media_type="text/css", content=CSS)
-book.add_item(style)
+    return toc_structure, all_chapters
 
-for chap in all_chapters + [cover, nav_page]:
-    chap.add_item(style)
 
 # -----------------------------
-# Update Cover with Top Story
+# BOOK ASSEMBLY
 # -----------------------------
-top_headline = "Daily Edition"
-if all_chapters:
-    # Get the title of the first article
-    top_headline = all_chapters[0].title
-
-# Newspaper Style Cover HTML
-cover_html = f"""
+def cover_page_html(today_human, all_chapters):
+    top_headline = "Daily Edition"
+    if all_chapters:
+        # Get the title of the first article
+        top_headline = all_chapters[0].title
+
+    # Newspaper Style Cover HTML
+    return f"""
     <div style="text-align: center; font-family: 'Times New Roman', serif; margin-top: 2em;">
         <h1 style="font-size: 3em; line-height: 1; border-bottom: 3px double black; padding-bottom: 0.5em; margin-bottom: 0.2em;">The Guardian Daily</h1>
         <p style="border-bottom: 1px solid #666; padding-bottom: 0.5em; margin-top: 0; font-style: italic; font-size: 1.1em; color: #333;">
             {today_human} &bull; Generated Edition
         </p>
-        
+
         <div style="margin-top: 4em; padding: 0 1em;">
             <p style="text-transform: uppercase; font-size: 0.9em; letter-spacing: 2px; color: #555; margin-bottom: 0.5em;">Top Story</p>
             <h2 style="font-size: 2.5em; line-height: 1.2; font-weight: bold; margin-top: 0;">{top_headline}</h2>
         </div>
-        
+
         <div style="margin-top: 5em; font-size: 0.9em; color: #888;">
             <p>Plus {len(all_chapters)-1 if len(all_chapters) > 1 else 0} other stories</p>
         </div>
     </div>
 """
 
-cover.content = cover_html
+
+def finalize_book(book, toc_structure, all_chapters, today_human):
+    """
+    Writes the cover (it needs the top story) and the navigation files, and closes the book.
+    """
+    print("\nBuilding nav.xhtml...")
+    with metrics.stage("epub_finalize"):
+        cover = book.add_chapter("Cover", "cover.xhtml", cover_page_html(today_human, all_chapters))
+        book.finalize([cover] + toc_structure, [cover] + all_chapters)
+
 
 # -----------------------------
-print("Writing EPUB...")
-epub.write_epub(EPUB_FILE, book)
+# BUILD
+# -----------------------------
+def _build_contents(config, book, previous, manifest, today_human):
+    """
+    Fetches every enabled source into the book and finalises it.
+    Returns (toc_structure, chapters).
+    """
+    _progress(config, 2, "Discovering feeds...", stage="discover")
+    discovered, sections, hn_top_ids = discover(config)
+
+    # Store structure for TOC: [(SectionName, [Chapter/Link...]), ...]
+    _progress(config, 10, "Downloading articles...", stage="guardian")
+    toc_structure, all_chapters = fetch_guardian(
+        sections, book, previous, manifest,
+        progress=lambda done, total, section, title: _progress(
+            config, 10 + 60 * done / total, f"Downloaded {done}/{total} articles", section=section, article=title))
+
+    # BBC INTEGRATION
+    if "BBC Top Stories" in discovered:
+        _progress(config, 70, "Fetching BBC Top Stories...", stage="bbc", section="BBC Top Stories")
+        try:
+            bbc_items = fetch_bbc_news(
+                config.articles_per_feed, book, entries=discovered["BBC Top Stories"]["entries"],
+                previous=previous, manifest=manifest,
+                progress=lambda done, total, title: _progress(
+                    config, 70 + 10 * done / total, f"BBC: {done}/{total} stories",
+                    section="BBC Top Stories", article=title))
+            if bbc_items:
+                toc_structure.append(("BBC Top Stories", bbc_items))
+                all_chapters.extend(bbc_items)
+        except Exception as e:
+            print(f"⚠ Failed to fetch BBC: {e}")
 
-print("Converting MOBI...")
-try:
-    subprocess.check_call(["ebook-converter", str(EPUB_FILE), str(MOBI_FILE)])
-    print("✔ MOBI created")
-except subprocess.CalledProcessError:
-    print("⚠ MOBI failed")
+    # HACKER NEWS INTEGRATION
+    if hn_top_ids is not None:
+        _progress(config, 80, "Fetching Hacker News threads...", stage="hn", section="Hacker News")
+        try:
+            hn_items = fetch_hn_threads(
+                config.articles_per_feed, book, top_ids=hn_top_ids,
+                progress=lambda done, total, title: _progress(
+                    config, 80 + 12 * done / total, f"Hacker News: {done}/{total} threads",
+                    section="Hacker News", article=title))
+            if hn_items:
+                toc_structure.append(("Hacker News", hn_items))
+                all_chapters.extend(hn_items)
+                for chap in hn_items:
+                    # Threads keep changing, so they're recorded but never reused
+                    manifest.add("Hacker News", chap)
+        except Exception as e:
+            print(f"⚠ Failed to fetch Hacker News: {e}")
+
+    article_cache.evict()
+    images.evict()
+    print(f"\n{article_cache.summary()}. {images.summary()}")
+    print(extract.summary())
+    print(http_client.summary())
+
+    _progress(config, 92, "Writing EPUB...", stage="epub")
+    finalize_book(book, toc_structure, all_chapters, today_human)
+    return toc_structure, all_chapters
+
+
+def build_edition(config=None):
+    """
+    Builds one edition in-process and returns {"epub", "conversions", "chapters", "dropped",
+    "seconds", "warm"}, where conversions maps each extra requested format to a Future for its
+    file and dropped lists what was left out (see metrics.dropped).
+    Safe to call repeatedly from a long-lived worker: imports, the HTTP pool, the process pool
+    and the on-disk caches all stay warm between builds.
+    """
+    global _builds_done
+    config = config or EditionConfig()
+    started = time.perf_counter()
+    warm = _builds_done > 0
+    _reset_counters()
+
+    output = Path(config.output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    today_human = datetime.now().strftime("%d %B %Y")
+
+    epub_file = output / f"guardian-{today_str}.epub"
+    report = metrics.start_build(epub_file.stem)
+
+    # The previous edition stays on disk until the new one is written, so unchanged
+    # chapters can be copied out of it
+    previous = PreviousEdition.load(output)
+    manifest = Manifest()
+
+    # Chapters and images are written into the archive as they arrive. It goes to a temp file
+    # next to the old edition and is swapped in at the end, so downloads never see a half-written file
+    tmp_file = epub_file.with_name(f"{epub_file.name}.tmp")
+    book = StreamingEpub(tmp_file, f"guardian-{today_str}", f"Guardian Daily - {today_human}",
+                         language="en", author=today_human)
+    book.add_style("style/main.css", CSS)
+    try:
+        with deadline.limit("build", config.budget):
+            toc_structure, all_chapters = _build_contents(config, book, previous, manifest, today_human)
+    except BaseException:
+        book.abort()
+        metrics.abandon_build(report)
+        raise
+    finally:
+        if previous is not None:
+            print(f"Reused {previous.reused} chapters from the previous edition")
+            previous.close()
+
+    tmp_file.replace(epub_file)
+    manifest.write(epub_file, date=today_str, articles_per_feed=config.articles_per_feed, sections=config.sections)
+    edition_index.write(epub_file, toc_structure, chapters=len(all_chapters), dropped=len(report.dropped))
+
+    cleanup(output, epub_file)
+
+    # Conversions run in their own pool; the caller decides whether to wait for them
+    conversions = {fmt: formats.submit(epub_file, fmt) for fmt in formats.parse(config.formats) if fmt != "epub"}
+    if conversions:
+        print(f"Converting to {', '.join(conversions)} in the background...")
+    for fmt, future in conversions.items():
+        report.track_conversion(fmt, future)
+    formats.evict()
+
+    seconds = time.perf_counter() - started
+    _builds_done += 1
+    if warm:
+        print(f"\nBuild took {seconds:.1f}s (warm process)")
+    else:
+        print(f"\nBuild took {seconds:.1f}s (cold process, plus {IMPORT_SECONDS:.1f}s of imports)")
+
+    if report.dropped:
+        print(f"⚠ Partial edition: {len(report.dropped)} items dropped")
+        for drop in report.dropped:
+            print(f"   {drop['source']}: {drop['item']} ({drop['reason']})")
+
+    report_path = metrics.finish_build(
+        report,
+        seconds=round(seconds, 3),
+        warm=warm,
+        chapters=len(all_chapters),
+        reused=previous.reused if previous is not None else 0,
+        epub_bytes=epub_file.stat().st_size,
+        http={host: dict(s) for host, s in http_client.STATS.items()},
+        caches={
+            "feeds": dict(feed_cache.STATS),
+            "articles": dict(article_cache.STATS),
+            "images": dict(images.STATS),
+            "hn_items": dict(hn_cache.STATS),
+        },
+        extraction={key: round(value, 3) for key, value in extract.STATS.items()},
+    )
+
+    print(f"\nDone — EPUB: {epub_file}, report: {report_path}")
+    return {
+        "epub": epub_file,
+        "conversions": conversions,
+        "chapters": len(all_chapters),
+        "dropped": list(report.dropped),
+        "seconds": seconds,
+        "warm": warm,
+    }
+
+
+def cleanup(output, epub_file):
+    """
+    Keeps the EDITIONS_KEEP newest editions (EPUB, index and converted formats) and only the
+    new edition's manifest. Formats converted from a replaced EPUB of the same date are stale.
+    """
+    print("Cleaning up old files...")
+    editions = sorted(output.glob("*.epub"), key=lambda p: p.stat().st_mtime, reverse=True)
+    kept = {p.stem for p in editions[:max(1, EDITIONS_KEEP)]}
+    for fmt in formats.FORMATS:
+        for old_file in output.glob(f"*.{fmt}"):
+            if old_file.stem not in kept or (old_file.stem == epub_file.stem and fmt != "epub"):
+                old_file.unlink()
+    for old_file in output.glob("*.index.json"):
+        if old_file.name.removesuffix(".index.json") not in kept:
+            old_file.unlink()
+    for old_file in output.glob("*.manifest.json"):
+        if old_file != manifest_path(epub_file):
+            old_file.unlink()
+
+
+def parse_args(argv):
+    """
+    CLI: generate.py [articles_per_feed] ["Section, Section, ..."]
+    """
+    config = EditionConfig()
+
+    if len(argv) > 0:
+        try:
+            config.articles_per_feed = int(argv[0])
+        except ValueError:
+            pass  # Keep default if invalid
 
-print(f"\nDone — EPUB: {EPUB_FILE}, MOBI: {MOBI_FILE}")
+    if len(argv) > 1:
+        # Second argument is comma-separated list of enabled feeds
+        raw_feeds = argv[1]
+        if raw_feeds.strip():
+            config.sections = [f.strip() for f in raw_feeds.split(",") if f.strip()]
+
+    return config
+
+
+def wait_for_conversions(result):
+    """
+    Blocks until the build's format conversions finish. Returns False if any failed.
+    """
+    ok = True
+    for fmt, future in result["conversions"].items():
+        try:
+            print(f"✔ {fmt.upper()}: {future.result()}")
+        except Exception as e:
+            print(f"⚠ {fmt.upper()} failed: {e}")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    config = parse_args(sys.argv[1:])
+    # Shares the web app's build lock, so cron never runs on top of a build from the UI
+    try:
+        with build_lock.hold(config.output_dir, blocking=False):
+            result = build_edition(config)
+    except build_lock.BuildLocked as e:
+        print(f"Skipping: {e}")
+        sys.exit(0)
+    # The CLI waits for conversions; OUTPUT_FORMATS=epub,mobi restores the old cron output
+    wait_for_conversions(result)
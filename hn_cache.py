@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from cache_paths import CACHE_DIR, sqlite_connector
+
+# HN items keyed by id. Items stop changing once they're a few hours old, so how long a
+# cached copy stays fresh depends on the item's own age.
+DB_PATH = CACHE_DIR / "hn_items.sqlite"
+
+# (max item age, freshness) pairs in seconds, checked in order
+FRESHNESS = [
+    (2 * 3600, 5 * 60),          # under 2 hours old: still collecting replies and edits
+    (24 * 3600, 30 * 60),        # under a day: slowing down
+    (3 * 86400, 6 * 3600),       # under 3 days: effectively settled
+]
+SETTLED_TTL = 7 * 86400          # older: treat as immutable for a week
+LIST_TTL = int(os.getenv("HN_TOPSTORIES_TTL", "300"))
+
+STATS = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def freshness(item, now=None):
+    """
+    How long a cached copy of item may be served, based on when the item was posted.
+    """
+    now = now or time.time()
+    age = now - (item.get("time") or now)
+    for max_age, ttl in FRESHNESS:
+        if age < max_age:
+            return ttl
+    return SETTLED_TTL
+
+
+def _init(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS items ("
+        " id INTEGER PRIMARY KEY, json TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS lists ("
+        " name TEXT PRIMARY KEY, json TEXT NOT NULL, fetched_at REAL NOT NULL)"
+    )
+
+
+_connect = sqlite_connector(DB_PATH, _init)
+
+
+def get_many(item_ids):
+    """
+    Returns {id: item} for the ids that have a fresh cached copy.
+    """
+    if not item_ids:
+        return {}
+    found = {}
+    now = time.time()
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(item_ids), 500):
+                    chunk = list(item_ids[start:start + 500])
+                    marks = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT id, json FROM items WHERE id IN ({marks}) AND expires_at > ?", (*chunk, now)
+                    )
+                    found.update((item_id, json.loads(data)) for item_id, data in rows)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"   HN cache read failed: {e}")
+        if metrics.live():
+            STATS["hits"] += len(found)
+            STATS["misses"] += len(item_ids) - len(found)
+    return found
+
+
+def put_many(items):
+    now = time.time()
+    rows = [(item["id"], json.dumps(item), now + freshness(item, now)) for item in items if item and "id" in item]
+    if not rows:
+        return
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                conn.executemany("INSERT OR REPLACE INTO items (id, json, expires_at) VALUES (?, ?, ?)", rows)
+                conn.execute("DELETE FROM items WHERE expires_at < ?", (now - SETTLED_TTL,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"   HN cache write failed: {e}")
+
+
+def get_list(name):
+    """
+    Returns a cached id list (e.g. topstories) if it was fetched within LIST_TTL, else None.
+    """
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                row = conn.execute("SELECT json, fetched_at FROM lists WHERE name = ?", (name,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+    if row and time.time() - row[1] <= LIST_TTL:
+        return json.loads(row[0])
+    return None
+
+
+def put_list(name, ids):
+    with _lock:
+        try:
+            conn = _connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO lists (name, json, fetched_at) VALUES (?, ?, ?)",
+                    (name, json.dumps(ids), time.time()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"   HN cache write failed: {e}")
+
+
+def summary():
+    return f"HN item cache: {STATS['hits']} hits, {STATS['misses']} misses"
@@ -1,47 +1,145 @@
-import requests
+import os
+
 from bs4 import BeautifulSoup
-from ebooklib import epub
 from datetime import datetime
 import time
 
+import article_cache
+import deadline
+import hn_cache
+import metrics
+from fetch_pool import fetch, map_ordered, set_host_limit
+
 # Official HN API
 API_BASE = "https://hacker-news.firebaseio.com/v0"
+HN_TOPSTORIES_URL = f"{API_BASE}/topstories.json"
 HEADERS = {"User-Agent": "GuardianEbookGenerator/1.0"}
 
+# How long a built thread chapter may be reused from the article cache (seconds)
+THREAD_CACHE_TTL = 30 * 60
+
+# Reduced limit to 50 comments total per story for better speed
+MAX_COMMENTS_PER_STORY = 50
+# Replies are off by default (top-level comments only, as per user request).
+# HN_COMMENT_DEPTH=1..3 walks that many levels of replies, breadth-first.
+MAX_COMMENT_DEPTH = 3
+COMMENT_DEPTH = min(int(os.getenv("HN_COMMENT_DEPTH", "0")), MAX_COMMENT_DEPTH)
+# Hard cap on API requests for the whole HN section; nothing is requested past it
+ITEM_BUDGET = int(os.getenv("HN_ITEM_BUDGET", "600"))
+# The Firebase API copes with far more parallel requests than the news sites
+CONCURRENCY = int(os.getenv("HN_CONCURRENCY", "16"))
+# Seconds the HN section may take within the build's budget (0 = no separate limit)
+BUDGET = float(os.getenv("HN_BUDGET", "120"))
+
+set_host_limit("hacker-news.firebaseio.com", CONCURRENCY)
+
+
 def fetch_item(item_id):
     """
     Fetches a single item (story or comment) from the HN API.
     """
     try:
-        r = requests.get(f"{API_BASE}/item/{item_id}.json", headers=HEADERS, timeout=10)
-        if r.status_code == 200:
-            return r.json()
+        r = fetch(f"{API_BASE}/item/{item_id}.json", headers=HEADERS, timeout=10)
+        return r.json()
     except Exception as e:
         print(f"   Error fetching item {item_id}: {e}")
     return None
 
-def build_comment_html(comment_id, depth=0):
+
+class ItemBudget:
+    """
+    Counts API requests against ITEM_BUDGET so the section stops issuing them once it's spent.
+    """
+
+    def __init__(self, limit):
+        self.remaining = limit
+
+    def take(self, wanted):
+        granted = max(0, min(wanted, self.remaining))
+        self.remaining -= granted
+        return granted
+
+
+def fetch_items(item_ids, budget):
+    """
+    Fetches a wave of items, serving fresh ones from the item cache and requesting the rest
+    in parallel. Returns {id: item or None}; only real requests count against the budget.
+    """
+    items = hn_cache.get_many(item_ids)
+    missing = [item_id for item_id in item_ids if item_id not in items]
+    missing = missing[:budget.take(len(missing))]
+    with metrics.stage("hn_items"):
+        results = map_ordered(fetch_item, missing, workers=CONCURRENCY)
+    metrics.count("hn_items_fetched", len(missing))
+    metrics.count("hn_items_cached", len(items))
+    fetched = {item_id: item for item_id, (item, _) in zip(missing, results)}
+    hn_cache.put_many(list(fetched.values()))
+    items.update(fetched)
+    return items
+
+
+def load_top_ids():
     """
-    Recursively fetches and builds HTML for a comment tree.
-    Limiting depth and count to avoid thousands of requests.
+    Returns the topstories id list, reusing one fetched within the last few minutes.
+    """
+    top_ids = hn_cache.get_list("topstories")
+    if top_ids is None:
+        r = fetch(HN_TOPSTORIES_URL, headers=HEADERS, timeout=10)
+        top_ids = r.json()
+        hn_cache.put_list("topstories", top_ids)
+    return top_ids
+
+
+def collect_comments(stories, budget):
+    """
+    Walks the comment trees of all stories together, breadth-first, one parallel wave per step.
+    Each story gets exactly MAX_COMMENTS_PER_STORY readable comments (or all it has), down to
+    COMMENT_DEPTH levels of replies. Stops early at the current deadline.
+    Returns ({story_id: {comment_id: comment}}, ids of the stories whose comments were cut short).
+    """
+    # Per story: FIFO of (comment_id, depth) still to fetch, and the comments kept so far
+    frontier = {s["id"]: [(kid, 0) for kid in s.get("kids", [])] for s in stories}
+    kept = {s["id"]: {} for s in stories}
+
+    cut = set()
+    while budget.remaining > 0 and not deadline.expired():
+        wave = []
+        for story_id, queue in frontier.items():
+            wanted = MAX_COMMENTS_PER_STORY - len(kept[story_id])
+            taken, frontier[story_id] = queue[:wanted], queue[wanted:]
+            wave.extend((story_id, comment_id, depth) for comment_id, depth in taken)
+        if not wave:
+            break
+
+        items = fetch_items([comment_id for _, comment_id, _ in wave], budget)
+        for story_id, comment_id, depth in wave:
+            comment = items.get(comment_id)
+            if comment is None and deadline.expired():
+                cut.add(story_id)
+            if not comment or comment.get("deleted") or comment.get("dead") or not comment.get("text"):
+                continue
+            comment["depth"] = depth
+            kept[story_id][comment_id] = comment
+            if depth < COMMENT_DEPTH:
+                frontier[story_id].extend((kid, depth + 1) for kid in comment.get("kids", []))
+
+    if deadline.expired():
+        cut.update(story_id for story_id, queue in frontier.items()
+                   if queue and len(kept[story_id]) < MAX_COMMENTS_PER_STORY)
+    return kept, cut
+
+
+def build_comment_html(comment, depth=0):
+    """
+    Builds the HTML block for a single comment.
     """
-    if depth > 3: # Limit nesting depth
-        return ""
-        
-    comment = fetch_item(comment_id)
-    if not comment or comment.get("deleted") or comment.get("dead"):
-        return ""
-        
     text = comment.get("text", "")
-    if not text:
-        return ""
-        
     user = comment.get("by", "anon")
-    
+
     # Visual indentation
     margin_left = depth * 1.5
     top_style = "border-top: 1px solid #eee; padding-top: 10px; margin-top: 10px;" if depth == 0 else ""
-    
+
     html = f"""
     <div style="margin-left: {margin_left}em; {top_style} margin-bottom: 10px; font-family: sans-serif;">
         <div style="font-size: 0.85em; color: #555; margin-bottom: 4px;">
@@ -52,111 +150,142 @@ def build_comment_html(comment_id, depth=0):
         </div>
     </div>
     """
-    
-    # We are no longer fetching replies (kids) as per user request
+
     return html
 
-def fetch_hn_threads(limit, book):
+
+def render_thread(kid_ids, comments):
+    """
+    Renders the fetched comments in thread order (each comment followed by its replies).
+    """
+    html = ""
+    for kid_id in kid_ids:
+        comment = comments.get(kid_id)
+        if comment is None:
+            continue
+        html += build_comment_html(comment, comment["depth"])
+        html += render_thread(comment.get("kids", []), comments)
+    return html
+
+
+def build_thread_content(story, comments):
+    story_id = story["id"]
+    title = story.get("title", "No Title")
+
+    # Build Chapter Content
+    soup = BeautifulSoup("<div></div>", "html.parser")
+
+    # Header
+    h1 = soup.new_tag("h1")
+    h1.string = title
+    soup.append(h1)
+
+    # Links
+    if "url" in story:
+        p_link = soup.new_tag("p")
+        link_a = soup.new_tag("a", href=story["url"])
+        link_a.string = "Read Article / Context"
+        p_link.append(link_a)
+        soup.append(p_link)
+
+    p_thread = soup.new_tag("p")
+    thread_a = soup.new_tag("a", href=f"https://news.ycombinator.com/item?id={story_id}")
+    thread_a.string = "Original HN Thread"
+    p_thread.append(thread_a)
+    soup.append(p_thread)
+
+    hr = soup.new_tag("hr")
+    soup.append(hr)
+
+    h2 = soup.new_tag("h2")
+    h2.string = "Discussion"
+    soup.append(h2)
+
+    if not story.get("kids"):
+        p_no = soup.new_tag("p")
+        p_no.string = "No comments yet."
+        soup.append(p_no)
+    else:
+        # Append comments
+        c_soup = BeautifulSoup(render_thread(story["kids"], comments), "html.parser")
+        soup.append(c_soup)
+
+    return str(soup)
+
+
+def fetch_hn_threads(limit, book, top_ids=None, progress=None):
     """
     Fetches top HN threads and their comments using the API.
+    Stories and comments are requested in parallel waves within a global item budget.
+    Pass top_ids when the topstories list was already resolved by the feed discovery phase.
+    progress, if given, is called as progress(done, total, title) as each thread is written.
+    At BUDGET (or the build's deadline) the threads fetched so far are used, with the comments
+    collected so far.
     """
     print(f"\n== Hacker News (API)")
-    
+    with deadline.limit("Hacker News", BUDGET):
+        return _fetch_threads(limit, book, top_ids, progress)
+
+
+def _fetch_threads(limit, book, top_ids, progress):
+
     # 1. Get Top Stories
-    try:
-        r = requests.get(f"{API_BASE}/topstories.json", headers=HEADERS, timeout=10)
-        r.raise_for_status()
-        top_ids = r.json()
-    except Exception as e:
-        print(f" ⚠ Failed to fetch top stories: {e}")
-        return []
+    if top_ids is None:
+        try:
+            top_ids = load_top_ids()
+        except Exception as e:
+            print(f" ⚠ Failed to fetch top stories: {e}")
+            return []
 
-    chapters = []
-    count = 0
+    budget = ItemBudget(ITEM_BUDGET)
 
-    # 2. Process each story
-    for story_id in top_ids:
-        if count >= limit:
-            break
-            
-        story = fetch_item(story_id)
-        if not story:
-            continue
-            
+    # 2. Fetch stories in waves until we have enough
+    stories = []
+    candidates = list(top_ids)
+    while len(stories) < limit and candidates and budget.remaining > 0 and not deadline.expired():
+        wave, candidates = candidates[:limit - len(stories)], candidates[limit - len(stories):]
+        items = fetch_items(wave, budget)
+        stories.extend(items[story_id] for story_id in wave if items.get(story_id))
+    if len(stories) < limit and deadline.expired():
+        print(f"   ⚠ {deadline.reason()}: {limit - len(stories)} threads short")
+        metrics.dropped("hn", f"{limit - len(stories)} top stories", deadline.reason())
+
+    # 3. Threads move quickly, so cached chapters are only reused for a short while
+    contents = {}
+    for story in stories:
+        cached = article_cache.get(f"https://news.ycombinator.com/item?id={story['id']}", max_age=THREAD_CACHE_TTL)
+        if cached is not None:
+            contents[story["id"]] = cached
+
+    # 4. Fetch comments for everything else, all stories at once
+    pending = [s for s in stories if s["id"] not in contents]
+    if pending:
+        print(f"   Fetching up to {MAX_COMMENTS_PER_STORY} comments for {len(pending)} stories...")
+    comments, cut = collect_comments(pending, budget)
+    for story in pending:
+        with metrics.stage("hn_render"):
+            content = build_thread_content(story, comments[story["id"]])
+        if story["id"] in cut:
+            # Partial thread: used in this edition, but not cached for the next build
+            metrics.dropped("hn", story.get("title", story["id"]),
+                            f"{deadline.reason()}: {len(comments[story['id']])} comments kept")
+        else:
+            article_cache.put(f"https://news.ycombinator.com/item?id={story['id']}", content)
+        contents[story["id"]] = content
+
+    if budget.remaining <= 0:
+        print(f"   ⚠ HN item budget ({ITEM_BUDGET}) reached")
+    print(f"   {hn_cache.summary()}")
+
+    # 5. Create Chapters
+    chapters = []
+    for count, story in enumerate(stories):
         title = story.get("title", "No Title")
         print(f" • {title}")
-        
-        # Build Chapter Content
-        soup = BeautifulSoup("<div></div>", "html.parser")
-        
-        # Header
-        h1 = soup.new_tag("h1")
-        h1.string = title
-        soup.append(h1)
-        
-        # Links
-        if "url" in story:
-            p_link = soup.new_tag("p")
-            link_a = soup.new_tag("a", href=story["url"])
-            link_a.string = "Read Article / Context"
-            p_link.append(link_a)
-            soup.append(p_link)
-            
-        p_thread = soup.new_tag("p")
-        hn_url = f"https://news.ycombinator.com/item?id={story_id}"
-        thread_a = soup.new_tag("a", href=hn_url)
-        thread_a.string = "Original HN Thread"
-        p_thread.append(thread_a)
-        soup.append(p_thread)
-        
-        hr = soup.new_tag("hr")
-        soup.append(hr)
-        
-        h2 = soup.new_tag("h2")
-        h2.string = "Discussion"
-        soup.append(h2)
-        
-        # Fetch Top Comments (Kids)
-        # Reduced limit to 50 comments total per story for better speed
-        MAX_COMMENTS_PER_STORY = 50
-        kids = story.get("kids", [])
-        
-        if not kids:
-            p_no = soup.new_tag("p")
-            p_no.string = "No comments yet."
-            soup.append(p_no)
-        else:
-            print(f"   Fetching up to {MAX_COMMENTS_PER_STORY} comments for {story_id}...")
-            comments_html = ""
-            comments_fetched = 0
-            
-            # Use a queue-based approach for breadth-first or just a controlled recursive one
-            # To keep it simple, we'll iterate root kids and let them recurse a bit
-            for kid_id in kids:
-                if comments_fetched >= MAX_COMMENTS_PER_STORY:
-                    break
-                
-                # We'll allow each root comment to fetch its subtree, 
-                # but we'll stop the whole process once we hit 100 total.
-                comment_tree_html = build_comment_html(kid_id, depth=0)
-                if comment_tree_html:
-                    comments_html += comment_tree_html
-                    # Rough count of comments added (estimated by looking for the user-header div)
-                    comments_fetched += comment_tree_html.count('<strong>')
-            
-            # Append comments
-            c_soup = BeautifulSoup(comments_html, "html.parser")
-            soup.append(c_soup)
-
-        # Create Chapter
         fname = f"hn-{count}.xhtml"
-        chap = epub.EpubHtml(
-            title=f"HN: {title}",
-            file_name=fname,
-            content=str(soup)
-        )
-        book.add_item(chap)
+        chap = book.add_chapter(f"HN: {title}", fname, contents.pop(story["id"]))
         chapters.append(chap)
-        count += 1
-        
-    return chapters
\ No newline at end of file
+        if progress is not None:
+            progress(count + 1, len(stories), title)
+
+    return chapters
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# One pooled keep-alive client for every fetcher, so repeat requests to theguardian.com,
+# i.guim.co.uk, bbc.co.uk and the HN API reuse their TCP+TLS connections.
+# Compressed responses (gzip, deflate, and br when the brotli package is installed) are
+# requested and decoded transparently by requests/urllib3.
+POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+STATS = {}
+_stats_lock = threading.Lock()
+
+
+def _retry_policy():
+    options = dict(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        # Jitter spreads retries from parallel workers instead of hitting the host in lockstep
+        return Retry(backoff_jitter=0.5, **options)
+    except TypeError:
+        # urllib3 < 2 has no jitter support
+        return Retry(**options)
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=_retry_policy())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session, adapter
+
+
+_session, _adapter = _build_session()
+
+
+def get(url, timeout=15, headers=None, **kwargs):
+    """
+    GET through the shared session. Retries 429/5xx, connection errors and timeouts with
+    jittered exponential backoff; the response is returned as-is (callers check the status).
+    """
+    host = urlsplit(url).netloc
+    started = time.monotonic()
+    r = None
+    try:
+        r = _session.get(url, headers=headers, timeout=timeout, **kwargs)
+        return r
+    finally:
+        _record(host, r, time.monotonic() - started, counted_bytes=not kwargs.get("stream"))
+
+
+def _record(host, r, elapsed, counted_bytes=True):
+    if not metrics.live():
+        return
+    with _stats_lock:
+        s = STATS.setdefault(host, {"requests": 0, "errors": 0, "retries": 0, "bytes": 0, "seconds": 0.0})
+        s["requests"] += 1
+        s["seconds"] += elapsed
+        if r is None:
+            s["errors"] += 1
+            return
+        retries = getattr(r.raw, "retries", None)
+        s["retries"] += len(retries.history) if retries is not None else 0
+        if counted_bytes:
+            s["bytes"] += len(r.content)
+
+
+def connection_counts():
+    """
+    Returns {host: connections opened} from the urllib3 pools; compare with request counts
+    to see how much keep-alive saved.
+    """
+    counts = {}
+    pools = _adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+            counts[pool.host] = counts.get(pool.host, 0) + pool.num_connections
+    return counts
+
+
+def summary():
+    connections = connection_counts()
+    lines = ["HTTP connections:"]
+    with _stats_lock:
+        for host, s in sorted(STATS.items()):
+            opened = connections.get(host.split(":")[0], "?")
+            lines.append(
+                f"  {host}: {s['requests']} requests over {opened} connections, "
+                f"{s['bytes'] // 1024} KB, {s['retries']} retries, {s['errors']} errors, {s['seconds']:.1f}s"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+from PIL import Image
+
+from cache_paths import CACHE_DIR, write_atomic
+from fetch_pool import fetch, cpu_call
+import metrics
+
+# Final JPEG bytes, stored by hash of the source image so identical images are encoded once.
+# urls/ maps an image url to that hash so unchanged images aren't even downloaded.
+IMAGE_CACHE_DIR = CACHE_DIR / "images"
+BLOB_DIR = IMAGE_CACHE_DIR / "blobs"
+URL_DIR = IMAGE_CACHE_DIR / "urls"
+MAX_AGE_DAYS = float(os.getenv("IMAGE_CACHE_DAYS", "14"))
+
+# Kindle-aware output: cap to the device screen (default Paperwhite 1072x1448),
+# optionally grayscale for e-ink, and aim for a per-image byte budget.
+MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1072"))
+MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "1448"))
+GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "").lower() in ("1", "true", "yes")
+MAX_BYTES = int(float(os.getenv("IMAGE_MAX_KB", "150")) * 1024)
+QUALITY = 60
+MIN_QUALITY = 30
+
+# Cached output depends on these settings, so they're part of the blob name
+PROFILE = f"{MAX_WIDTH}x{MAX_HEIGHT}{'-gray' if GRAYSCALE else ''}-{MAX_BYTES // 1024}k"
+
+STATS = {"hits": 0, "misses": 0, "source_bytes": 0, "output_bytes": 0}
+_stats_lock = threading.Lock()
+
+
+def _url_key(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def _count(hit, source_bytes, output_bytes):
+    if not metrics.live():
+        return
+    with _stats_lock:
+        STATS["hits" if hit else "misses"] += 1
+        STATS["source_bytes"] += source_bytes
+        STATS["output_bytes"] += output_bytes
+
+
+def _save(im, quality):
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def encode_jpeg(raw):
+    """
+    Re-encodes any source image as a small JPEG for the e-reader.
+    Runs in the process pool, so it must stay a plain function.
+    """
+    mode = "L" if GRAYSCALE else "RGB"
+    im = Image.open(io.BytesIO(raw))
+    # JPEG sources are decoded at a reduced scale (1/2, 1/4, 1/8) straight away
+    im.draft(mode, (MAX_WIDTH, MAX_HEIGHT))
+    im = im.convert(mode)
+    im.thumbnail((MAX_WIDTH, MAX_HEIGHT))
+
+    quality = QUALITY
+    data = _save(im, quality)
+    # Over budget: trade quality first, then resolution
+    while len(data) > MAX_BYTES and quality > MIN_QUALITY:
+        quality -= 10
+        data = _save(im, quality)
+    while len(data) > MAX_BYTES and min(im.size) > 200:
+        im = im.resize((im.width * 3 // 4, im.height * 3 // 4))
+        data = _save(im, quality)
+    return data
+
+
+def fetch_image(url):
+    """
+    Returns (digest, jpeg_bytes) for an image url, downloading and encoding only on a cache miss.
+    Safe to call from the fetch pool.
+    """
+    url_path = URL_DIR / _url_key(url)
+    try:
+        digest, source_size = url_path.read_text().split()
+        blob_path = BLOB_DIR / f"{digest}-{PROFILE}.jpg"
+        data = blob_path.read_bytes()
+        os.utime(blob_path)
+        os.utime(url_path)
+        _count(True, int(source_size), len(data))
+        return digest, data
+    except (OSError, ValueError):
+        pass
+
+    with metrics.stage("image_download"):
+        raw = fetch(url, timeout=10).content
+    digest = hashlib.sha256(raw).hexdigest()
+    blob_path = BLOB_DIR / f"{digest}-{PROFILE}.jpg"
+    try:
+        data = blob_path.read_bytes()
+    except OSError:
+        with metrics.stage("image_encode"):
+            data = cpu_call(encode_jpeg, raw)
+        try:
+            write_atomic(blob_path, data)
+        except OSError as e:
+            print(f"   image cache write failed: {e}")
+    try:
+        write_atomic(url_path, f"{digest} {len(raw)}".encode())
+    except OSError as e:
+        print(f"   image cache write failed: {e}")
+    _count(False, len(raw), len(data))
+    return digest, data
+
+
+def add_to_book(book, digest, data):
+    """
+    Writes an image into the book (an epub_writer.StreamingEpub) once per distinct content
+    and returns its src path.
+    """
+    return book.add_image(f"img-{digest[:16]}", f"images/{digest[:16]}.jpg", data)
+
+
+def evict():
+    """
+    Removes cached images that haven't been used for MAX_AGE_DAYS.
+    """
+    cutoff = time.time() - MAX_AGE_DAYS * 86400
+    for folder in (BLOB_DIR, URL_DIR):
+        if not folder.exists():
+            continue
+        for path in folder.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+def summary():
+    saved = STATS["source_bytes"] - STATS["output_bytes"]
+    return (f"Image cache: {STATS['hits']} hits, {STATS['misses']} misses. "
+            f"Images {STATS['source_bytes'] // 1024} KB -> {STATS['output_bytes'] // 1024} KB "
+            f"(saved {saved // 1024} KB)")
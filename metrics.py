@@ -0,0 +1,298 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+# Lightweight build instrumentation. stage() times a step and adds it both to the build in
+# progress (which ends up in a JSON report next to the edition) and to process-wide totals;
+# /metrics renders the totals, the latest report and a summary of past reports for Prometheus.
+REPORTS_DIR = Path(os.getenv("BUILD_REPORTS_DIR", "output/reports"))
+REPORTS_KEEP = int(os.getenv("BUILD_REPORTS_KEEP", "30"))
+
+# Process-wide {stage: [seconds, calls]} (includes work outside builds: conversions, SMTP)
+TOTALS = {}
+_lock = threading.Lock()
+_current = None
+# Report bound to this thread with using(): pool workers keep the one current when their
+# work was submitted, even if that build has since returned and another has started
+_local = threading.local()
+_UNBOUND = object()
+
+
+class BuildReport:
+    """
+    Everything measured during one build. Stages are summed over all their calls. Figures
+    arriving after the build has finished (from work it stopped waiting for at its deadline)
+    are dropped; only background conversions are still added.
+    """
+
+    def __init__(self, edition):
+        self.edition = edition
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.articles = []
+        self.dropped = []
+        self.conversions = {}
+        self.extra = {}
+        self.path = None
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            if self.finished:
+                return
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+            stage["seconds"] += seconds
+            stage["count"] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            if self.finished:
+                return
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def article(self, source, url, **figures):
+        with self._lock:
+            if self.finished:
+                return
+            self.articles.append({"source": source, "url": url, **figures})
+
+    def drop(self, source, item, reason):
+        with self._lock:
+            if self.finished:
+                return
+            self.dropped.append({"source": source, "item": item, "reason": reason})
+
+    def track_conversion(self, fmt, future):
+        """
+        Times a background conversion from submission to completion and adds it to the
+        report once it finishes (rewriting the file if it was already written).
+        """
+        submitted = time.monotonic()
+
+        def done(f):
+            with self._lock:
+                self.conversions[fmt] = {"seconds": round(time.monotonic() - submitted, 3),
+                                         "ok": f.exception() is None}
+            if self.path is not None:
+                self.write()
+
+        future.add_done_callback(done)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "edition": self.edition,
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                **self.extra,
+                "stages": {k: {"seconds": round(v["seconds"], 3), "count": v["count"]} for k, v in self.stages.items()},
+                "counters": dict(self.counters),
+                "conversions": dict(self.conversions),
+                "articles": list(self.articles),
+                "dropped": list(self.dropped),
+            }
+
+    def write(self):
+        REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+        if self.path is None:
+            stamp = datetime.fromtimestamp(self.started).strftime("%Y%m%d-%H%M%S")
+            self.path = REPORTS_DIR / f"{self.edition}-{stamp}.json"
+        tmp = self.path.with_name(f"{self.path.name}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(self.to_dict(), indent=1, default=str))
+        tmp.replace(self.path)
+        return self.path
+
+
+def start_build(edition):
+    global _current
+    _current = BuildReport(edition)
+    return _current
+
+
+def _close(report):
+    global _current
+    with report._lock:
+        report.finished = True
+    if _current is report:
+        _current = None
+
+
+def finish_build(report, **extra):
+    """
+    Stores the build's summary figures, writes its report and prunes old reports.
+    """
+    _close(report)
+    report.extra.update(extra)
+    path = report.write()
+    for old in sorted(REPORTS_DIR.glob("*.json"))[:-REPORTS_KEEP]:
+        old.unlink(missing_ok=True)
+    return path
+
+
+def abandon_build(report):
+    _close(report)
+
+
+def current():
+    """
+    The report this thread's work belongs to: the one bound with using(), else the build
+    in progress (None outside builds).
+    """
+    report = getattr(_local, "report", _UNBOUND)
+    return _current if report is _UNBOUND else report
+
+
+@contextmanager
+def using(report):
+    """
+    Makes report the current one in this thread (fetch pool workers record into their caller's).
+    """
+    previous = getattr(_local, "report", _UNBOUND)
+    _local.report = report
+    try:
+        yield report
+    finally:
+        _local.report = previous
+
+
+def live():
+    """
+    False in a thread still working for a build that has finished. Per-build counters kept
+    outside the report (cache hits, extractor use, HTTP stats) check this before counting,
+    since by then they have been reset for the next build.
+    """
+    report = current()
+    return report is None or not report.finished
+
+
+def observe(name, seconds):
+    with _lock:
+        total = TOTALS.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+    report = current()
+    if report is not None:
+        report.observe(name, seconds)
+
+
+def count(name, amount=1):
+    report = current()
+    if report is not None:
+        report.count(name, amount)
+
+
+def article(source, url, **figures):
+    report = current()
+    if report is not None:
+        report.article(source, url, **figures)
+
+
+def dropped(source, item, reason):
+    """
+    Records something left out of the edition (an article, a thread's comments) and why.
+    """
+    report = current()
+    if report is not None:
+        report.drop(source, item, reason)
+
+
+@contextmanager
+def stage(name, into=None):
+    """
+    Times the block as one call of stage `name`. Pass a dict as into to also collect the
+    seconds per stage for a per-article record.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed)
+        if into is not None:
+            into[name] = round(into.get(name, 0.0) + elapsed, 4)
+
+
+# -----------------------------
+# Prometheus text format
+# -----------------------------
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _reports():
+    reports = []
+    for path in sorted(REPORTS_DIR.glob("*.json")):
+        try:
+            reports.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return reports
+
+
+def prometheus_text():
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    with _lock:
+        totals = {name: list(total) for name, total in TOTALS.items()}
+    metric("guardian_stage_seconds_total", "counter", "Time spent per stage since the process started.",
+           [({"stage": name}, round(seconds, 4)) for name, (seconds, _) in sorted(totals.items())])
+    metric("guardian_stage_calls_total", "counter", "Calls per stage since the process started.",
+           [({"stage": name}, calls) for name, (_, calls) in sorted(totals.items())])
+
+    reports = _reports()
+    metric("guardian_builds_recorded", "gauge", "Build reports on disk.", [({}, len(reports))])
+    if reports:
+        seconds = [r.get("seconds", 0) for r in reports]
+        metric("guardian_build_seconds", "summary", "Build wall-clock time over the recorded builds.",
+               [({"quantile": "0.5"}, _quantile(seconds, 0.5)), ({"quantile": "0.9"}, _quantile(seconds, 0.9))])
+        lines.append(f"guardian_build_seconds_sum {round(sum(seconds), 3)}")
+        lines.append(f"guardian_build_seconds_count {len(seconds)}")
+
+        stage_sums = {}
+        for r in reports:
+            for name, s in r.get("stages", {}).items():
+                stage_sums[name] = stage_sums.get(name, 0.0) + s["seconds"]
+        metric("guardian_recorded_stage_seconds_sum", "gauge", "Time per stage summed over the recorded builds.",
+               [({"stage": name}, round(value, 3)) for name, value in sorted(stage_sums.items())])
+
+        last = reports[-1]
+        metric("guardian_last_build_timestamp_seconds", "gauge", "Start of the latest build.",
+               [({}, int(datetime.fromisoformat(last["started"]).timestamp()))])
+        metric("guardian_last_build_seconds", "gauge", "Wall-clock time of the latest build.", [({}, last.get("seconds", 0))])
+        metric("guardian_last_build_chapters", "gauge", "Chapters in the latest edition.", [({}, last.get("chapters", 0))])
+        metric("guardian_last_build_epub_bytes", "gauge", "EPUB size of the latest edition.", [({}, last.get("epub_bytes", 0))])
+        metric("guardian_last_build_stage_seconds", "gauge", "Time per stage in the latest build.",
+               [({"stage": name}, s["seconds"]) for name, s in sorted(last.get("stages", {}).items())])
+        metric("guardian_last_build_cache_events", "gauge", "Cache hits and misses in the latest build.",
+               [({"cache": cache, "result": result}, value)
+                for cache, stats in sorted(last.get("caches", {}).items())
+                for result, value in sorted(stats.items()) if result in ("hits", "misses")])
+        extraction = last.get("extraction", {})
+        metric("guardian_last_build_extractions", "gauge", "Articles per extractor (site fast path or readability) in the latest build.",
+               [({"extractor": path}, extraction.get(path, 0)) for path in ("fast", "readability") if path in extraction])
+        metric("guardian_last_build_extraction_seconds", "gauge", "Extraction time per extractor in the latest build.",
+               [({"extractor": path}, extraction.get(f"{path}_seconds", 0)) for path in ("fast", "readability")
+                if path in extraction])
+        metric("guardian_last_build_http_bytes", "gauge", "Bytes downloaded per host in the latest build.",
+               [({"host": host}, s["bytes"]) for host, s in sorted(last.get("http", {}).items())])
+        metric("guardian_last_build_conversion_seconds", "gauge", "Format conversion time for the latest build.",
+               [({"format": fmt}, c["seconds"]) for fmt, c in sorted(last.get("conversions", {}).items())])
+
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import build_lock
+import edition_index
+import formats
+import generate
+import metrics
+from epub_writer import Chapter, StreamingEpub, read_toc
+from cache_paths import CACHE_DIR
+
+# Several personalised editions from one fetch. Each profile picks its own sections and
+# article count; one shared edition covering all of them (every section any profile wants,
+# the largest article count) is built the normal way, so everything is fetched and cleaned
+# once, and each profile's EPUB is then packaged in parallel by copying its chapters out of
+# that archive.
+PROFILES_FILE = Path(os.getenv("PROFILES_FILE", "profiles.json"))
+SHARED_DIR = CACHE_DIR / "shared-edition"
+
+# TOC section names that differ from the section name a config enables
+TOC_SECTIONS = {"Hacker News": "Hacker News (Comments)"}
+
+
+def load_profiles(path=PROFILES_FILE):
+    """
+    Reads {name: EditionConfig} from a JSON file such as
+    {"alice": {"articles_per_feed": 3, "sections": ["World", "Science"], "formats": ["epub", "mobi"]}}.
+    A profile's output_dir defaults to OUTPUT/<name>; a missing "sections" means all of them.
+    """
+    data = json.loads(Path(path).read_text())
+    profiles = {}
+    for name, spec in data.items():
+        profiles[name] = generate.EditionConfig(
+            articles_per_feed=int(spec.get("articles_per_feed", 5)),
+            sections=spec.get("sections"),
+            output_dir=Path(spec.get("output_dir", generate.OUTPUT / name)),
+            formats=formats.parse(spec.get("formats", formats.DEFAULT_FORMATS)),
+        )
+    return profiles
+
+
+def shared_config(profiles):
+    """
+    The one edition whose articles cover every profile.
+    """
+    configs = list(profiles.values())
+    sections = None
+    if all(c.sections is not None for c in configs):
+        sections = sorted({name for c in configs for name in c.sections})
+    feeds = {}
+    for c in configs:
+        feeds.update(c.feeds)
+    return generate.EditionConfig(
+        articles_per_feed=max(c.articles_per_feed for c in configs),
+        sections=sections,
+        output_dir=SHARED_DIR,
+        feeds=feeds,
+        formats=("epub",),
+        budget=max(c.budget for c in configs),
+    )
+
+
+def active_profiles(profiles):
+    """
+    The profiles that have something to build: a profile with no sections or no articles
+    per feed is skipped with a warning.
+    """
+    active = {}
+    for name, config in profiles.items():
+        if config.articles_per_feed <= 0 or config.sections == []:
+            print(f"⚠ Skipping profile {name}: no sections or articles enabled")
+            continue
+        active[name] = config
+    return active
+
+
+def build_profiles(profiles):
+    """
+    Builds every profile's edition from one shared fetch. Returns {name: {"epub",
+    "conversions", "chapters", "seconds"}} plus the shared build's result under "shared",
+    or {} when no profile has anything to build.
+    """
+    profiles = active_profiles(profiles)
+    if not profiles:
+        print("⚠ No profiles configured: nothing to build")
+        return {}
+    started = time.perf_counter()
+    with build_lock.hold(SHARED_DIR):
+        shared = generate.build_edition(shared_config(profiles))
+        print(f"\nShared fetch took {shared['seconds']:.1f}s; packaging {len(profiles)} editions...")
+        with ThreadPoolExecutor(max_workers=len(profiles), thread_name_prefix="profile") as pool:
+            futures = {name: pool.submit(package, name, config, shared) for name, config in profiles.items()}
+            results = {name: future.result() for name, future in futures.items()}
+    print(f"✔ {len(profiles)} editions in {time.perf_counter() - started:.1f}s "
+          f"(shared fetch {shared['seconds']:.1f}s)")
+    results["shared"] = shared
+    return results
+
+
+def package(name, config, shared):
+    """
+    Writes one profile's edition from the shared edition's archive: its sections, each cut
+    to its article count, with a cover of its own. Nothing is fetched or rendered again.
+    """
+    started = time.perf_counter()
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    today_human = datetime.now().strftime("%d %B %Y")
+    output = Path(config.output_dir)
+    epub_file = output / f"guardian-{today_str}.epub"
+    tmp_file = epub_file.with_name(f"{epub_file.name}.tmp")
+
+    with build_lock.hold(output), metrics.stage("profile_package"):
+        book = StreamingEpub(tmp_file, f"guardian-{today_str}-{name}", f"Guardian Daily - {today_human} ({name})",
+                             language="en", author=today_human)
+        book.add_style("style/main.css", generate.CSS)
+        toc_structure, all_chapters = [], []
+        try:
+            with zipfile.ZipFile(shared["epub"]) as archive:
+                for section, chapters in read_toc(archive):
+                    if not config.is_enabled(TOC_SECTIONS.get(section, section)):
+                        continue
+                    entries = []
+                    for title, file_name in chapters[:config.articles_per_feed]:
+                        # A chapter listed under two sections is stored once
+                        chap = book.copy_chapter(archive, title, file_name,
+                                                 f"{Path(file_name).stem}-link-{len(toc_structure)}")
+                        if isinstance(chap, Chapter):
+                            all_chapters.append(chap)
+                        entries.append(chap)
+                    toc_structure.append((section, entries))
+            generate.finalize_book(book, toc_structure, all_chapters, today_human)
+        except BaseException:
+            book.abort()
+            raise
+        tmp_file.replace(epub_file)
+        edition_index.write(epub_file, toc_structure, chapters=len(all_chapters), dropped=len(shared["dropped"]),
+                            profile=name)
+        generate.cleanup(output, epub_file)
+
+    conversions = {fmt: formats.submit(epub_file, fmt) for fmt in config.formats if fmt != "epub"}
+    seconds = time.perf_counter() - started
+    print(f"✔ {name}: {epub_file} ({len(all_chapters)} chapters, {seconds:.1f}s)")
+    return {"epub": epub_file, "conversions": conversions, "chapters": len(all_chapters), "seconds": seconds}
+
+
+if __name__ == "__main__":
+    # python profiles.py [profiles.json]
+    results = build_profiles(load_profiles(sys.argv[1] if len(sys.argv) > 1 else PROFILES_FILE))
+    ok = bool(results) and all([generate.wait_for_conversions(result) for name, result in results.items() if name != "shared"])
+    formats.evict()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,134 @@
+import re
+import shutil
+import zipfile
+from html import escape, unescape
+from pathlib import Path
+
+import formats
+from epub_writer import EPUB_ROOT, IMAGE_SRC, Chapter, StreamingEpub, read_toc
+from cache_paths import CACHE_DIR
+
+# An edition too big for one Send to Kindle email goes out as several smaller EPUBs: whole
+# sections, in edition order, packed into volumes under the size limit (a section that is too
+# big on its own is split by article). Chapters and images are copied out of the edition's
+# archive as they are, using its table of contents, so nothing is fetched or rendered again.
+VOLUMES_DIR = CACHE_DIR / "volumes"
+
+# Room for the message headers and the text part, and for each volume's cover and package files
+MESSAGE_OVERHEAD = 4096
+VOLUME_OVERHEAD = 32 * 1024
+
+
+def encoded_size(size):
+    """
+    Bytes an attachment of `size` bytes takes in an email: base64 in 76-character lines.
+    """
+    encoded = (size + 2) // 3 * 4
+    return encoded + encoded // 76 * 2 + MESSAGE_OVERHEAD
+
+
+def split(epub_path, max_bytes):
+    """
+    Returns the EPUB files to send for epub_path so that each fits in a max_bytes email:
+    [epub_path] itself when it fits, else its volumes (cached by content and limit).
+    """
+    epub_path = Path(epub_path)
+    if encoded_size(epub_path.stat().st_size) <= max_bytes:
+        return [epub_path]
+
+    digest = formats.epub_hash(epub_path)[:16]
+    target = VOLUMES_DIR / f"{epub_path.stem}-{digest}-{max_bytes}"
+    if (target / "done").exists():
+        return sorted(target.glob("*.epub"), key=lambda p: int(p.stem.rsplit("part", 1)[1]))
+
+    shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True)
+    with zipfile.ZipFile(epub_path) as archive:
+        sections = read_toc(archive)
+        # Largest archive whose encoded email still fits
+        limit = (max_bytes - MESSAGE_OVERHEAD) * 76 // 78 * 3 // 4 - VOLUME_OVERHEAD
+        volumes = _pack(archive, sections, limit)
+        title = _title(archive) or epub_path.stem
+        paths = [_write_volume(archive, target / f"{epub_path.stem}-part{n}.epub", f"{epub_path.stem}-part{n}",
+                               f"{title} ({n}/{len(volumes)})", volume)
+                 for n, volume in enumerate(volumes, start=1)]
+    (target / "done").touch()
+    evict()
+    print(f"✔ Split {epub_path.name} into {len(paths)} volumes for delivery")
+    return paths
+
+
+def _title(archive):
+    match = re.search(rb"<dc:title>(.*?)</dc:title>", archive.read(EPUB_ROOT + "content.opf"), re.S)
+    return unescape(match.group(1).decode("utf-8")) if match else None
+
+
+def _chapter_size(archive, file_name, counted):
+    # Stored size of the chapter plus any of its images not already in the volume
+    size = archive.getinfo(EPUB_ROOT + file_name).compress_size
+    for src in IMAGE_SRC.findall(archive.read(EPUB_ROOT + file_name)):
+        name = src.decode("utf-8")
+        if name not in counted and EPUB_ROOT + name in archive.NameToInfo:
+            counted.add(name)
+            size += archive.getinfo(EPUB_ROOT + name).compress_size
+    return size
+
+
+def _pack(archive, sections, limit):
+    """
+    Groups sections into volumes of at most limit stored bytes (more only when one article
+    is bigger on its own): [[(section name, [(title, file name), ...]), ...], ...].
+    """
+    volumes = []
+    current, current_size, counted = [], 0, set()
+    for name, chapters in sections:
+        part, part_size = [], 0
+        for chapter in chapters:
+            size = _chapter_size(archive, chapter[1], counted)
+            if current_size + part_size + size > limit and (current or part):
+                # Close the volume; the section continues in the next one
+                if part:
+                    current.append((name, part))
+                volumes.append(current)
+                current, current_size, part, part_size = [], 0, [], 0
+                counted = set()
+                size = _chapter_size(archive, chapter[1], counted)
+            part.append(chapter)
+            part_size += size
+        if part:
+            current.append((name, part))
+            current_size += part_size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def _write_volume(archive, path, identifier, title, sections):
+    book = StreamingEpub(path, identifier, title, language="en")
+    book.add_style("style/main.css", archive.read(EPUB_ROOT + "style/main.css"))
+    names = ", ".join(dict.fromkeys(name for name, _ in sections))
+    cover = book.add_chapter("Cover", "cover.xhtml", f"<h1>{escape(title)}</h1><p>{escape(names)}</p>")
+
+    toc, spine = [], []
+    for name, chapters in sections:
+        entries = []
+        for chapter_title, file_name in chapters:
+            # A chapter listed under two sections is stored once per volume
+            chap = book.copy_chapter(archive, chapter_title, file_name, f"{Path(file_name).stem}-link-{len(toc)}")
+            if isinstance(chap, Chapter):
+                spine.append(chap)
+            entries.append(chap)
+        toc.append((name, entries))
+    book.finalize([cover] + toc, [cover] + spine)
+    return path
+
+
+def evict(keep=5):
+    """
+    Keeps the volumes of the most recent `keep` split editions.
+    """
+    if not VOLUMES_DIR.exists():
+        return
+    dirs = sorted(VOLUMES_DIR.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in dirs[keep:]:
+        shutil.rmtree(path, ignore_errors=True)